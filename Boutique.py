@@ -2,94 +2,210 @@ import discord
 from discord.ext import commands
 from discord.ui import View, Select, Button
 import sqlite3
+from db_metrics import metrics
+from fixed_point import format_milli
+from storage import PURCHASE_LIMIT_REACHED, PURCHASE_NO_FUNDS, PURCHASE_NO_ITEM, PURCHASE_SOLD_OUT, PURCHASES_PAGE_SIZE
+
+SHOP_PAGE_SIZE = 20  # Discord limite à 25 champs d'embed / options de menu
+SHOP_SORT_LABELS = {"price": "prix", "name": "nom"}
+SHOP_SEARCH_LIMIT = 10  # résultats affichés par recherche
+
+class ShopPage:
+    """Page du catalogue construite une fois : articles, embed et options du menu d'achat."""
+
+    def __init__(self, items, has_next, sort):
+        self.items = items
+        self.has_next = has_next
+        # Curseur (valeur du tri, id) du dernier article, point de départ de la page suivante
+        self.next_cursor = None
+        if items:
+            item_id, name, price, _ = items[-1]
+            self.next_cursor = (price if sort == "price" else name, item_id)
+
+        self.embed = discord.Embed(title="🏪 Boutique", color=discord.Color.blue())
+        for item_id, name, price, description in items:
+            desc_text = f"Prix: {price} jetons"
+            if description:
+                desc_text += f"\n📝 {description}"
+            self.embed.add_field(name=f"{name}", value=desc_text, inline=False)
+
+        self.options = []
+        for item_id, name, price, description in items:
+            # Limiter la longueur du nom à 100 caractères (limite Discord)
+            display_name = name[:100] if len(name) > 100 else name
+            # Limiter la description à 100 caractères pour Discord
+            desc_text = f"Prix: {price} jetons"
+            if description:
+                short_desc = description[:50] + "..." if len(description) > 50 else description
+                desc_text = f"{short_desc} - {price} jetons"
+            self.options.append(discord.SelectOption(
+                label=display_name,
+                description=desc_text[:100],  # Discord limite à 100 caractères
+                value=str(item_id)
+            ))
 
 class ShopView(View):
     """Vue pour afficher et gérer la boutique."""
 
-    def __init__(self, db_manager):
+    def __init__(self, db_manager, shop):
         super().__init__(timeout=60)
         self.db = db_manager
+        self.shop = shop
 
     @discord.ui.button(label="🛒 Voir les articles", style=discord.ButtonStyle.primary)
+    @metrics.scoped()
     async def view_items(self, interaction: discord.Interaction, button: Button):
         try:
-            items = self.db.get_all_items()
-            if not items:
+            view = ShopBrowserView(self.db, self.shop)
+            if not await view.load_page():
                 await interaction.response.send_message("❌ Aucun article disponible dans la boutique.", ephemeral=True)
                 return
 
-            # Limiter à 20 articles pour respecter les limites Discord (25 max)
-            items_display = items[:20]
-
-            embed = discord.Embed(title="🏪 Boutique", color=discord.Color.blue())
-            for item_id, name, price, description in items_display:
-                desc_text = f"Prix: {price} jetons"
-                if description:
-                    desc_text += f"\n📝 {description}"
-                embed.add_field(name=f"{name}", value=desc_text, inline=False)
-
-            if len(items) > 20:
-                embed.set_footer(text=f"Affichage de 20 articles sur {len(items)} disponibles")
-
-            await interaction.response.send_message(embed=embed, view=PurchaseView(self.db, items_display), ephemeral=True)
+            await interaction.response.send_message(embed=view.build_embed(), view=view, ephemeral=True)
         except Exception as e:
             print(f"Erreur lors de l'affichage des articles: {e}")
             await interaction.response.send_message("❌ Erreur lors du chargement de la boutique.", ephemeral=True)
 
     @discord.ui.button(label="💰 Mon argent", style=discord.ButtonStyle.secondary)
+    @metrics.scoped()
     async def check_balance(self, interaction: discord.Interaction, button: Button):
         try:
             user_id = interaction.user.id
             # S'assurer que l'utilisateur existe
-            if self.db.user_get_balance(user_id) is None:
-                self.db.user_create(user_id)
+            if await self.db.user_get_balance(user_id) is None:
+                await self.db.user_create(user_id)
 
-            balance = self.db.user_get_balance(user_id)
-            await interaction.response.send_message(f"💰 Vous avez **{balance}** jetons.", ephemeral=True)
+            balance = await self.db.user_get_balance(user_id)
+            if balance is None:
+                await interaction.response.send_message("❌ Erreur lors de la vérification du solde.", ephemeral=True)
+                return
+            await interaction.response.send_message(f"💰 Vous avez **{format_milli(balance)}** jetons.", ephemeral=True)
         except Exception as e:
             print(f"Erreur lors de la vérification du solde: {e}")
             await interaction.response.send_message("❌ Erreur lors de la vérification du solde.", ephemeral=True)
 
     @discord.ui.button(label="📦 Mes achats", style=discord.ButtonStyle.success)
+    @metrics.scoped()
     async def my_purchases(self, interaction: discord.Interaction, button: Button):
-        purchases = self.db.get_user_purchases(interaction.user.id)
-        if not purchases:
+        view = PurchasesHistoryView(self.db, interaction.user.id)
+        if not await view.load_page():
             await interaction.response.send_message("📦 Vous n'avez encore rien acheté.", ephemeral=True)
             return
 
-        embed = discord.Embed(title="📦 Mes achats", color=discord.Color.green())
-        for item_name, timestamp in purchases:
-            embed.add_field(name=item_name, value=f"Acheté le: {timestamp}", inline=False)
-
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+        await interaction.response.send_message(embed=view.build_embed(), view=view, ephemeral=True)
 
-class PurchaseView(View):
-    """Vue pour acheter des articles."""
+class PurchasesHistoryView(View):
+    """Historique des achats paginé (boutons précédent/suivant)."""
 
-    def __init__(self, db_manager, items):
+    def __init__(self, db_manager, user_id, page_size=PURCHASES_PAGE_SIZE):
         super().__init__(timeout=60)
         self.db = db_manager
-        self.items = items
-
-        # Créer un menu déroulant avec les articles (limité à 20 pour Discord)
-        options = []
-        items_limited = items[:20]  # Discord limite à 25 options max
-        for item_id, name, price, description in items_limited:
-            # Limiter la longueur du nom à 100 caractères (limite Discord)
-            display_name = name[:100] if len(name) > 100 else name
-            # Limiter la description à 100 caractères pour Discord
-            desc_text = f"Prix: {price} jetons"
-            if description:
-                short_desc = description[:50] + "..." if len(description) > 50 else description
-                desc_text = f"{short_desc} - {price} jetons"
-            options.append(discord.SelectOption(
-                label=display_name,
-                description=desc_text[:100],  # Discord limite à 100 caractères
-                value=str(item_id)
-            ))
-
-        if options:
-            self.add_item(ItemSelect(self.db, options))
+        self.user_id = user_id
+        self.page_size = page_size
+        # Curseurs (timestamp, id) du début de chaque page déjà visitée ; None = première page
+        self.cursors = [None]
+        self.purchases = []
+        self.has_next = False
+
+    async def load_page(self):
+        """Charge la page courante ; retourne False si elle est vide."""
+        # Une ligne de plus que la page pour savoir s'il existe une page suivante
+        rows = await self.db.get_user_purchases(self.user_id, before=self.cursors[-1], limit=self.page_size + 1)
+        self.has_next = len(rows) > self.page_size
+        self.purchases = rows[:self.page_size]
+        self.previous_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = not self.has_next
+        return bool(self.purchases)
+
+    def build_embed(self):
+        embed = discord.Embed(title="📦 Mes achats", color=discord.Color.green())
+        for purchase_id, item_name, timestamp in self.purchases:
+            embed.add_field(name=item_name, value=f"Acheté le: {timestamp}", inline=False)
+        embed.set_footer(text=f"Page {len(self.cursors)}")
+        return embed
+
+    @discord.ui.button(label="◀️ Précédent", style=discord.ButtonStyle.secondary)
+    @metrics.scoped()
+    async def previous_page(self, interaction: discord.Interaction, button: Button):
+        if len(self.cursors) > 1:
+            self.cursors.pop()
+        await self.load_page()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+    @discord.ui.button(label="Suivant ▶️", style=discord.ButtonStyle.secondary)
+    @metrics.scoped()
+    async def next_page(self, interaction: discord.Interaction, button: Button):
+        if self.has_next:
+            purchase_id, _, timestamp = self.purchases[-1]
+            self.cursors.append((timestamp, purchase_id))
+        await self.load_page()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+class ShopBrowserView(View):
+    """Catalogue paginé : menu d'achat de la page courante, boutons précédent/suivant et tri."""
+
+    def __init__(self, db_manager, shop, sort="price"):
+        super().__init__(timeout=60)
+        self.db = db_manager
+        self.shop = shop
+        self.sort = sort
+        # Curseurs du début de chaque page déjà visitée ; None = première page
+        self.cursors = [None]
+        self.page: ShopPage | None = None
+        self.select: ItemSelect | None = None
+
+    async def load_page(self):
+        """Charge la page courante ; retourne False si elle est vide."""
+        # Pages en cache dans le cog : pas d'accès à la base tant qu'aucun article n'est ajouté/supprimé
+        self.page = await self.shop.get_page(self.sort, self.cursors[-1])
+        if self.select is not None:
+            self.remove_item(self.select)
+            self.select = None
+        if self.page.options:
+            self.select = ItemSelect(self.db, list(self.page.options))
+            self.add_item(self.select)
+        self.previous_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = not self.page.has_next
+        self.toggle_sort.label = f"Trier par {SHOP_SORT_LABELS['name' if self.sort == 'price' else 'price']}"
+        return bool(self.page.items)
+
+    def build_embed(self):
+        embed = self.page.embed.copy()
+        embed.set_footer(text=f"Page {len(self.cursors)} — tri par {SHOP_SORT_LABELS[self.sort]}")
+        return embed
+
+    @discord.ui.button(label="◀️ Précédent", style=discord.ButtonStyle.secondary, row=1)
+    @metrics.scoped()
+    async def previous_page(self, interaction: discord.Interaction, button: Button):
+        if len(self.cursors) > 1:
+            self.cursors.pop()
+        await self.load_page()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+    @discord.ui.button(label="Suivant ▶️", style=discord.ButtonStyle.secondary, row=1)
+    @metrics.scoped()
+    async def next_page(self, interaction: discord.Interaction, button: Button):
+        if self.page.has_next:
+            self.cursors.append(self.page.next_cursor)
+        await self.load_page()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+    @discord.ui.button(label="Trier par nom", style=discord.ButtonStyle.primary, row=1)
+    @metrics.scoped()
+    async def toggle_sort(self, interaction: discord.Interaction, button: Button):
+        self.sort = "name" if self.sort == "price" else "price"
+        self.cursors = [None]
+        await self.load_page()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+class SearchResultsView(View):
+    """Menu d'achat des résultats d'une recherche."""
+
+    def __init__(self, db_manager, page):
+        super().__init__(timeout=60)
+        self.db = db_manager
+        if page.options:
+            self.add_item(ItemSelect(self.db, list(page.options)))
 
 class ItemSelect(Select):
     """Menu déroulant pour sélectionner un article à acheter."""
@@ -98,49 +214,54 @@ class ItemSelect(Select):
         super().__init__(placeholder="Choisissez un article à acheter...", options=options)
         self.db = db_manager
 
+    @metrics.scoped()
     async def callback(self, interaction: discord.Interaction):
         item_id = int(self.values[0])
         user_id = interaction.user.id
 
-        # Vérifier si l'utilisateur existe
-        if self.db.user_get_balance(user_id) is None:
-            self.db.user_create(user_id)
+        # Un seul aller-retour : contrôle du solde, débit et achat dans la même transaction
+        result = await self.db.purchase(user_id, item_id)
+        if result is None:
+            await interaction.response.send_message("❌ Erreur lors de l'achat.", ephemeral=True)
+            return
 
-        # Obtenir les informations de l'article
-        item_info = self.db.get_item(item_id)
-        if not item_info:
+        status, balance, item_info = result
+        if status == PURCHASE_NO_ITEM:
             await interaction.response.send_message("❌ Article introuvable.", ephemeral=True)
             return
 
         item_name, item_price, item_description = item_info
-        user_balance = self.db.user_get_balance(user_id)
 
-        # Vérifier si l'utilisateur a assez d'argent
-        if user_balance < item_price:
-            desc_text = f"\n📝 {item_description}" if item_description else ""
+        # Article limité : stock épuisé ou limite par utilisateur atteinte
+        if status == PURCHASE_SOLD_OUT:
+            await interaction.response.send_message(f"❌ **{item_name}** est en rupture de stock.", ephemeral=True)
+            return
+        if status == PURCHASE_LIMIT_REACHED:
             await interaction.response.send_message(
-                f"❌ Vous n'avez pas assez de jetons!\n"
-                f"**{item_name}**{desc_text}\n"
-                f"Prix: {item_price} jetons\n"
-                f"Votre solde: {user_balance} jetons",
-                ephemeral=True
+                f"❌ Vous avez atteint la limite d'achat pour **{item_name}**.", ephemeral=True
             )
             return
 
-        # Effectuer l'achat
-        success = self.db.purchase_item(user_id, item_id, item_price)
-        if success:
-            new_balance = user_balance - item_price
+        # L'utilisateur n'a pas assez d'argent
+        if status == PURCHASE_NO_FUNDS:
             desc_text = f"\n📝 {item_description}" if item_description else ""
             await interaction.response.send_message(
-                f"✅ Achat réussi!\n"
-                f"Vous avez acheté: **{item_name}**{desc_text}\n"
+                f"❌ Vous n'avez pas assez de jetons!\n"
+                f"**{item_name}**{desc_text}\n"
                 f"Prix: {item_price} jetons\n"
-                f"Nouveau solde: {new_balance} jetons",
+                f"Votre solde: {format_milli(balance)} jetons",
                 ephemeral=True
             )
-        else:
-            await interaction.response.send_message("❌ Erreur lors de l'achat.", ephemeral=True)
+            return
+
+        desc_text = f"\n📝 {item_description}" if item_description else ""
+        await interaction.response.send_message(
+            f"✅ Achat réussi!\n"
+            f"Vous avez acheté: **{item_name}**{desc_text}\n"
+            f"Prix: {item_price} jetons\n"
+            f"Nouveau solde: {format_milli(balance)} jetons",
+            ephemeral=True
+        )
 
 class Boutique(commands.Cog):
     """Cog pour la gestion de la boutique."""
@@ -148,6 +269,8 @@ class Boutique(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self._db = None
+        # Pages du catalogue en cache par (tri, curseur), invalidées par add_item / remove_item
+        self._pages: dict[tuple, ShopPage] = {}
 
     async def cog_load(self):
         """Chargement du cog."""
@@ -155,7 +278,22 @@ class Boutique(commands.Cog):
         if not self._db:
             raise RuntimeError("❌ DBManager doit être chargé avant la Boutique")
 
-    @commands.command(name="boutique", aliases=["shop"])
+    async def get_page(self, sort, cursor):
+        """Retourne une page du catalogue, lue en base (requête par clé) au premier accès."""
+        page = self._pages.get((sort, cursor))
+        if page is None:
+            # Une ligne de plus que la page pour savoir s'il existe une page suivante
+            rows = await self._db.get_items_page(sort, cursor, SHOP_PAGE_SIZE + 1)
+            page = ShopPage(rows[:SHOP_PAGE_SIZE], len(rows) > SHOP_PAGE_SIZE, sort)
+            # get_items_page retourne aussi [] en cas d'erreur : ne pas figer une page vide
+            if page.items:
+                self._pages[(sort, cursor)] = page
+        return page
+
+    def invalidate_catalog(self):
+        self._pages.clear()
+
+    @commands.group(name="boutique", aliases=["shop"], invoke_without_command=True)
     async def boutique(self, ctx):
         """Ouvre la boutique."""
         if not self._db:
@@ -168,9 +306,48 @@ class Boutique(commands.Cog):
             color=discord.Color.gold()
         )
 
-        view = ShopView(self._db)
+        view = ShopView(self._db, self)
         await ctx.send(embed=embed, view=view)
 
+    @boutique.command(name="search", aliases=["recherche"])
+    async def search(self, ctx, *, text: str):
+        """Recherche un article par nom ou description. Usage: $shop search <texte>"""
+        if not self._db:
+            await ctx.send("❌ La boutique n'est pas disponible.")
+            return
+
+        items = await self._db.search_items(text, SHOP_SEARCH_LIMIT)
+        if not items:
+            await ctx.send(f"🔍 Aucun article ne correspond à « {text} ».")
+            return
+
+        page = ShopPage(items, False, "price")
+        embed = page.embed.copy()
+        embed.title = f"🔍 Résultats pour « {text} »"
+        await ctx.send(embed=embed, view=SearchResultsView(self._db, page))
+
+    @commands.command(name="inventaire", aliases=["inventory"])
+    async def inventaire(self, ctx, membre: discord.Member = None):
+        """Affiche les articles possédés. Usage: $inventaire [@membre]"""
+        if not self._db:
+            await ctx.send("❌ La boutique n'est pas disponible.")
+            return
+
+        if membre is None:
+            membre = ctx.author
+
+        inventory = await self._db.get_inventory(membre.id)
+        if not inventory:
+            await ctx.send(f"🎒 {membre.display_name} ne possède encore aucun article.")
+            return
+
+        embed = discord.Embed(title=f"🎒 Inventaire de {membre.display_name}", color=discord.Color.green())
+        for item_id, name, quantity in inventory[:25]:
+            embed.add_field(name=name, value=f"Quantité: {quantity}", inline=True)
+        if len(inventory) > 25:
+            embed.set_footer(text=f"Affichage de 25 articles sur {len(inventory)}")
+        await ctx.send(embed=embed)
+
     @commands.command(name="add_item")
     @commands.has_permissions(administrator=True)
     async def add_item(self, ctx, price: int, name: str, *, description: str = ""):
@@ -179,8 +356,9 @@ class Boutique(commands.Cog):
             await ctx.send("❌ La boutique n'est pas disponible.")
             return
 
-        success = self._db.add_item(name, price, description)
+        success = await self._db.add_item(name, price, description)
         if success:
+            self.invalidate_catalog()
             desc_text = f" avec la description: {description}" if description else ""
             await ctx.send(f"✅ Article **{name}** ajouté à la boutique pour {price} jetons{desc_text}.")
         else:
@@ -194,31 +372,66 @@ class Boutique(commands.Cog):
             await ctx.send("❌ La boutique n'est pas disponible.")
             return
 
-        success = self._db.remove_item(item_id)
+        success = await self._db.remove_item(item_id)
         if success:
+            self.invalidate_catalog()
             await ctx.send(f"✅ Article ID {item_id} supprimé de la boutique.")
         else:
             await ctx.send("❌ Erreur lors de la suppression de l'article.")
 
+    @commands.command(name="set_stock")
+    @commands.has_permissions(administrator=True)
+    async def set_stock(self, ctx, item_id: int, stock: str, per_user_limit: int = None):
+        """Limite un article. Usage: $set_stock <id> <stock|illimite> [limite par utilisateur]"""
+        if not self._db:
+            await ctx.send("❌ La boutique n'est pas disponible.")
+            return
+
+        if stock.lower() in ("illimite", "illimité", "-"):
+            stock = None
+        elif stock.isdigit():
+            stock = int(stock)
+        else:
+            await ctx.send("❌ Le stock doit être un nombre positif ou `illimite`.")
+            return
+        if per_user_limit is not None and per_user_limit <= 0:
+            await ctx.send("❌ La limite par utilisateur doit être positive.")
+            return
+
+        success = await self._db.set_item_stock(item_id, stock, per_user_limit)
+        if success:
+            stock_text = "illimité" if stock is None else str(stock)
+            limit_text = f", {per_user_limit} par utilisateur" if per_user_limit is not None else ""
+            await ctx.send(f"✅ Article ID {item_id} : stock {stock_text}{limit_text}.")
+        else:
+            await ctx.send("❌ Article introuvable.")
+
     @commands.command(name="list_items")
     @commands.has_permissions(administrator=True)
     async def list_items(self, ctx):
-        """Liste tous les articles de la boutique avec leurs IDs."""
+        """Liste tous les articles de la boutique avec leurs IDs.
+
+        Le catalogue est parcouru via les pages en cache du cog (get_page) : seules les
+        pages absentes du cache sont lues en base, un embed est envoyé par page.
+        """
         if not self._db:
             await ctx.send("❌ La boutique n'est pas disponible.")
             return
 
-        items = self._db.get_all_items()
-        if not items:
+        page = await self.get_page("price", None)
+        if not page.items:
             await ctx.send("❌ Aucun article dans la boutique.")
             return
 
-        embed = discord.Embed(title="📋 Liste des articles", color=discord.Color.blue())
-        for item_id, name, price, description in items:
-            desc_text = f"\n📝 {description}" if description else ""
-            embed.add_field(name=f"ID: {item_id}", value=f"{name} - {price} jetons{desc_text}", inline=False)
-
-        await ctx.send(embed=embed)
+        while True:
+            embed = discord.Embed(title="📋 Liste des articles", color=discord.Color.blue())
+            for item_id, name, price, description in page.items:
+                desc_text = f"\n📝 {description}" if description else ""
+                embed.add_field(name=f"ID: {item_id}", value=f"{name} - {price} jetons{desc_text}", inline=False)
+            await ctx.send(embed=embed)
+            if not page.has_next:
+                break
+            page = await self.get_page("price", page.next_cursor)
 
 async def setup(bot):
     await bot.add_cog(Boutique(bot))
\ No newline at end of file
@@ -1,7 +1,9 @@
 import discord
 import sqlite3
 from discord.ext import commands
-from db_manager import DBManager
+from storage import StorageBackend
+from db_metrics import metrics
+from fixed_point import format_milli, to_milli
 from poker_game import GameStatus, FakeMember, PlayerView
 from views.test_view import TestView
 
@@ -13,7 +15,7 @@ class BotCommands(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
-        self._db: DBManager | None = None
+        self._db: StorageBackend | None = None
 
     async def cog_load(self):
         """Méthode appelée automatiquement lors du chargement du Cog."""
@@ -30,14 +32,14 @@ class BotCommands(commands.Cog):
             member = ctx.author
 
         # FIXME A VOIR....
-        self._db.user_ensure_exist(member)
-        balance = self._db.user_get_balance(member.id)
+        await self._db.user_ensure_exist(member)
+        balance = await self._db.user_get_balance(member.id)
         if balance is None:
             await ctx.send(f"⚠️ Pas encore de compte ?")
             return
 
         # FIXME gerer "member nommé" vs "current ctx.member"
-        await ctx.send(f"💰 Ton solde est de {balance} jetons.")
+        await ctx.send(f"💰 Ton solde est de {format_milli(balance)} jetons.")
 
     @commands.command(name="niveau")
     async def niveau(self, ctx, membre: discord.Member = None):
@@ -47,35 +49,38 @@ class BotCommands(commands.Cog):
             membre = ctx.author
 
         # FIXME A VOIR....
-        # self._db.user_ensure_exist(membre)
-        niveau = self._db.user_get_niveau(membre.id)
+        # await self._db.user_ensure_exist(membre)
+        niveau = await self._db.user_get_niveau(membre.id)
         if niveau is None:
             await ctx.send(f"⚠️ Pas encore de compte ?")
             return
 
         # FIXME gerer "member nommé" vs "current ctx.member"
-        await ctx.send(f"{membre.mention} a {niveau} % d'expérience.")
+        await ctx.send(f"{membre.mention} a {format_milli(niveau)} % d'expérience.")
 
     # Commande pour payer une personne
     # FIXME : Il faut verifier que les users existent sinon les get/add_balance vont crasher
     @commands.command(name="donner")
     async def donner(self, ctx, target_member: discord.Member, amount: int):
-        self._db.user_ensure_exist(ctx.author)
-        self._db.user_ensure_exist(target_member)
-        author_balance = self._db.user_get_balance(ctx.author.id)
-        if author_balance < amount:
+        if amount <= 0:
+            await ctx.send("⚠️ Le montant doit être supérieur à 0 !")
+            return
+        await self._db.user_ensure_exist(ctx.author)
+        await self._db.user_ensure_exist(target_member)
+        # Contrôle du solde, débit et crédit en une seule écriture : des dons simultanés
+        # ne peuvent pas dépasser le solde
+        result = await self._db.user_transfer_balance(ctx.author.id, target_member.id, to_milli(amount))
+        if result is None:
+            await ctx.send("❌ Erreur lors du don.")
+            return
+        success, new_author_balance, new_target_balance = result
+        if not success:
             await ctx.send(
-                f"{ctx.author.mention}, votre solde est de {author_balance} jetons, vous n'avez pas assez pour donner {amount} jetons."
+                f"{ctx.author.mention}, votre solde est de {format_milli(new_author_balance)} jetons, vous n'avez pas assez pour donner {amount} jetons."
             )
             return
-        # Soustraire à l'author
-        new_author_balance = self._db.user_add_balance(ctx.author.id, -amount)
-
-        # Ajouter au target
-        new_target_balance = self._db.user_add_balance(target_member.id,
-                                                       amount)
         await ctx.send(
-            f"{ctx.author.mention} a donné {amount} jetons à {target_member.mention}. Nouveaux soldes : {ctx.author.mention}={new_author_balance} jetons, {target_member.mention}={new_target_balance} jetons"
+            f"{ctx.author.mention} a donné {amount} jetons à {target_member.mention}. Nouveaux soldes : {ctx.author.mention}={format_milli(new_author_balance)} jetons, {target_member.mention}={format_milli(new_target_balance)} jetons"
         )
 
     # Gestion des erreurs pour les commandes nécessitant des permissions administratives
@@ -86,15 +91,24 @@ class BotCommands(commands.Cog):
                 "Vous n'avez pas la permission d'utiliser cette commande.")
 
     # Commande pour donner de l'argent à un autre utilisateur (réservée aux admins)
-    # FIXME : Il faut verifier que les users existent sinon les get/add_balance vont crasher
     @commands.command(name="crediter")
     @commands.has_permissions(administrator=True)
     async def crediter(self, ctx, target_member: discord.Member, amount: int):
-        old_balance = self._db.user_get_balance(target_member.id)
-        new_balance = self._db.user_add_balance(target_member.id, amount)
+        # Compte créé avant la lecture : l'ancien solde est connu avant le crédit
+        await self._db.user_ensure_exist(target_member)
+        old_balance = await self._db.user_get_balance(target_member.id)
+        if old_balance is None:
+            await ctx.send("❌ Erreur lors de la lecture du solde, aucun crédit effectué.")
+            return
+        new_balance = await self._db.user_add_balance(target_member.id, to_milli(amount),
+                                                      reason="credit_admin",
+                                                      ref=f"admin:{ctx.author.id}")
+        if new_balance is None:
+            await ctx.send("❌ Erreur lors du crédit, aucun crédit effectué.")
+            return
 
         await ctx.send(
-            f"{target_member.mention} a reçu {amount} jetons ! Ancien solde : {old_balance} jetons, Nouveau solde: {new_balance} jetons."
+            f"{target_member.mention} a reçu {amount} jetons ! Ancien solde : {format_milli(old_balance)} jetons, Nouveau solde: {format_milli(new_balance)} jetons."
         )
 
         # Gestion des erreurs pour la commande de remise à zéro level
@@ -116,7 +130,7 @@ class BotCommands(commands.Cog):
     @commands.command(name="reset_niveau")
     @commands.has_permissions(administrator=True)
     async def reset_niveau(self, ctx, member: discord.Member):
-        new_niveau = self._db.user_reset_niveau(member.id)
+        new_niveau = await self._db.user_reset_niveau(member.id, ref=f"admin:{ctx.author.id}")
         if new_niveau == 0:
             await ctx.send(
                 f"L'expérience de {member.mention} a été remise à zéro.")
@@ -143,7 +157,7 @@ class BotCommands(commands.Cog):
     @commands.command(name="reset_balance")
     @commands.has_permissions(administrator=True)
     async def reset_balance(self, ctx, member: discord.Member):
-        new_balance = self._db.user_reset_balance(member.id)
+        new_balance = await self._db.user_reset_balance(member.id, ref=f"admin:{ctx.author.id}")
         if new_balance == 0:
             await ctx.send(f"Le solde de {member.mention} a été remis à zéro.")
         else:
@@ -162,6 +176,92 @@ class BotCommands(commands.Cog):
             await ctx.send("Une erreur est survenue.")
 
 
+    # Commande pour consulter l'efficacité du cache utilisateur de DBManager
+    @commands.command(name="cache_stats")
+    @commands.has_permissions(administrator=True)
+    async def cache_stats(self, ctx):
+        stats = self._db.user_cache_stats()
+        await ctx.send(
+            f"🗃️ Cache utilisateurs : {stats['size']}/{stats['max_size']} entrées, "
+            f"{stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%}), "
+            f"{stats['evictions']} évictions."
+        )
+
+    # Commande pour consulter le retard de l'ordonnanceur économique
+    @commands.command(name="economy_stats")
+    @commands.has_permissions(administrator=True)
+    async def economy_stats(self, ctx):
+        economy = self.bot.get_cog("EconomyManager")
+        if not economy:
+            await ctx.send("❌ EconomyManager n'est pas chargé.")
+            return
+        stats = economy.scheduler_stats()
+        await ctx.send(
+            f"⏱️ Ordonnanceur économique (tick toutes les {stats['interval_s']} s) : "
+            f"{stats['ticks']} ticks, {stats['skipped']} sautés, "
+            f"retard dernier {stats['last_lag_s']:.2f} s / max {stats['max_lag_s']:.2f} s, "
+            f"durée moy {stats['avg_ms']:.1f} ms / max {stats['max_ms']:.1f} ms, "
+            f"{stats['voice_sessions']} sessions vocales en cours.\n"
+            f"✉️ Messages : {stats['messages_rewarded']} récompensés, {stats['messages_limited']} limités, "
+            f"{stats['messages_duplicate']} répétés, "
+            f"{stats['message_buckets']} seaux en mémoire."
+        )
+
+    # Commande pour consulter les latences des appels au stockage
+    @commands.command(name="db_stats")
+    @commands.has_permissions(administrator=True)
+    async def db_stats(self, ctx, action: str = None):
+        """Usage: $db_stats [dump|reset]"""
+        if action == "dump":
+            path = metrics.dump()
+            await ctx.send(f"📁 Métriques du stockage écrites dans `{path}`.")
+            return
+        if action == "reset":
+            metrics.reset()
+            await ctx.send("🔄 Métriques du stockage remises à zéro.")
+            return
+
+        snapshot = metrics.snapshot()
+        if not snapshot["queries"]:
+            await ctx.send("📊 Aucun appel au stockage enregistré.")
+            return
+
+        embed = discord.Embed(title=f"📊 Stockage depuis {snapshot['since']}", color=discord.Color.blue())
+        # Les requêtes qui coûtent le plus au total d'abord
+        queries = sorted(snapshot["queries"].items(), key=lambda kv: kv[1]["avg_ms"] * kv[1]["count"], reverse=True)
+        lines = [f"`{name}` ×{q['count']} ({q['errors']} err) moy {q['avg_ms']:.2f} ms, p95 ≤{q['p95_ms']:.2f} ms, max {q['max_ms']:.2f} ms"
+                 for name, q in queries[:10]]
+        embed.add_field(name="Requêtes", value="\n".join(lines)[:1024], inline=False)
+        # Les portées qui font le plus d'appels par exécution d'abord (N+1)
+        scopes = sorted(snapshot["scopes"].items(), key=lambda kv: kv[1]["avg_calls"], reverse=True)
+        if scopes:
+            lines = [f"`{name}` ×{s['runs']} : {s['avg_calls']:.1f} appels en moyenne (max {s['max_calls']})"
+                     for name, s in scopes[:10]]
+            embed.add_field(name="Appels par commande", value="\n".join(lines)[:1024], inline=False)
+        await ctx.send(embed=embed)
+
+    # Commande pour consulter le journal des transactions d'un utilisateur
+    @commands.command(name="historique")
+    @commands.has_permissions(administrator=True)
+    async def historique(self, ctx, member: discord.Member, limit: int = 10):
+        entries = await self._db.get_user_ledger(member.id, min(limit, 25))
+        if not entries:
+            await ctx.send(f"🧾 Aucune transaction enregistrée pour {member.mention}.")
+            return
+
+        embed = discord.Embed(title=f"🧾 Historique de {member.display_name}", color=discord.Color.blue())
+        for argent, niveau, reason, ref, created_at in entries:
+            details = []
+            if argent:
+                details.append(f"{'+' if argent > 0 else ''}{format_milli(argent)} jetons")
+            if niveau:
+                details.append(f"{'+' if niveau > 0 else ''}{format_milli(niveau)} niveau")
+            if ref:
+                details.append(f"({ref})")
+            embed.add_field(name=f"{created_at} — {reason}", value=" ".join(details), inline=False)
+
+        await ctx.send(embed=embed)
+
     # Commande pour bannir un utilisateur par ID 
     @commands.command(name="ban")
     async def ban_id(self,
@@ -271,7 +371,7 @@ class BotCommands(commands.Cog):
 
         await ctx.send("La partie commence maintenant !")
 
-        self.bot.game.start_game()
+        await self.bot.game.start_game()
         self.bot.game.start_betting_round()
         await self.bot.game.display_entry_window(ctx)
 
@@ -418,10 +518,12 @@ class BotCommands(commands.Cog):
         12. $coucher - Se couche.
         13. $partir - Quitte la partie
         14. $boutique - Ouvre la boutique.
-        15. $roulette <mise> - Joue à la roulette russe.
+        15. $roulette <mise> - Joue à la roulette russe (article « Roulette russe » requis).
         16. $tirer - Tire une balle dans la roulette russe.
         17. $fuir - Abandonne la partie de roulette russe.
         18. $roulette_stats - Affiche vos statistiques.
+        19. $shop search <texte> - Recherche un article par nom ou description.
+        20. $inventaire [@utilisateur] - Affiche les articles possédés.
 
         Commandes admin
         1. $donner @utilisateur montant - Donne de l'argent à un utilisateur.
@@ -434,6 +536,11 @@ class BotCommands(commands.Cog):
         8. $add_item <prix> <nom> <description> - Ajoute un article à la boutique.
         9. $remove_item id - Supprime un article de la boutique.
         10. $list_items - Liste tous les articles de la boutique avec leurs IDs.
+        11. $cache_stats - Statistiques du cache utilisateurs de la base.
+        12. $historique @utilisateur [nombre] - Journal des transactions d'un utilisateur.
+        13. $db_stats [dump|reset] - Latences et nombre d'appels au stockage.
+        14. $set_stock id <stock|illimite> [limite] - Limite le stock et les achats par utilisateur.
+        15. $economy_stats - Ordonnanceur économique et limitation des gains par message.
         
         
 
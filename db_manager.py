@@ -1,324 +1,1076 @@
+import asyncio
+import os
 import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import aiosqlite
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
+from db_migrations import MIGRATIONS, LATEST_VERSION
+from fixed_point import format_milli, to_milli
+from db_metrics import db_error, instrumented
+from storage import (DEFAULT_ARGENT, ITEM_SORTS, LEDGER_COMPACTION_INTERVAL, LEDGER_RETENTION_DAYS,
+                     PURCHASE_LIMIT_REACHED, PURCHASE_NO_FUNDS, PURCHASE_NO_ITEM, PURCHASE_OK, PURCHASE_SOLD_OUT,
+                     PURCHASES_PAGE_SIZE, REWARDS_FLUSH_INTERVAL, StorageBackend, search_words)
 
 DB_PATH = "shops.db"  # Centralisation du chemin de la DB
+WRITE_BATCH_MAX = 256  # nombre max d'écritures regroupées dans une transaction
+READ_POOL_SIZE = 4  # connexions en lecture seule servies par le pool de threads
+USER_CACHE_SIZE = 2048  # nombre max de lignes users gardées en mémoire
+INVENTORY_CACHE_SIZE = 2048  # nombre max d'inventaires gardés en mémoire
 
-class DBManager(commands.Cog):
-    """Cog gérant les interactions avec la base de données."""
+# Profils de performance SQLite, appliqués à chaque connexion ouverte par DBManager.
+# Le profil est choisi par déploiement via la variable d'environnement DB_PROFILE.
+# journal_mode reste WAL partout : le pool de lecture en dépend.
+DB_PROFILES = {
+    "performance": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 268435456,  # 256 Mo
+        "cache_size": -65536,  # 64 Mo (valeur négative = Kio)
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,  # ms
+    },
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "mmap_size": 268435456,
+        "cache_size": -65536,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+    "low_memory": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 0,
+        "cache_size": -2000,
+        "temp_store": "DEFAULT",
+        "busy_timeout": 5000,
+    },
+}
+DEFAULT_DB_PROFILE = "performance"
 
-    def __init__(self, bot):
+
+class UserCache:
+    """Cache LRU des lignes users validées en base : user_id -> (argent, niveau) ou None (inexistant).
+
+    Alimenté en écriture par DBManager une fois chaque transaction validée. Les
+    lectures ne le remplissent que si aucune écriture n'a eu lieu pendant la
+    requête (compteur `generation`), pour ne jamais y remettre une valeur périmée.
+    """
+
+    def __init__(self, max_size=USER_CACHE_SIZE):
+        self.max_size = max_size
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._rows: OrderedDict[int, tuple | None] = OrderedDict()
+
+    def get(self, user_id):
+        """Retourne (trouvé, ligne)."""
+        if user_id in self._rows:
+            self._rows.move_to_end(user_id)
+            self.hits += 1
+            return True, self._rows[user_id]
+        self.misses += 1
+        return False, None
+
+    def fill(self, user_id, row, generation):
+        """Ajoute une ligne lue en base, sauf si une écriture est survenue depuis `generation`."""
+        if generation == self.generation:
+            self._store(user_id, row)
+
+    def write(self, user_id, row):
+        """Enregistre la nouvelle valeur d'une ligne après un commit."""
+        self.generation += 1
+        self._store(user_id, row)
+
+    def adjust(self, user_id, money, xp):
+        """Applique un delta à une ligne en cache (sans effet si absente)."""
+        self.generation += 1
+        if user_id not in self._rows:
+            return
+        row = self._rows[user_id]
+        argent, niveau = row if row is not None else (DEFAULT_ARGENT, 0)
+        self._rows[user_id] = (argent + money, niveau + xp)
+
+    def discard(self, user_id):
+        self.generation += 1
+        self._rows.pop(user_id, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._rows),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _store(self, user_id, row):
+        self._rows[user_id] = row
+        self._rows.move_to_end(user_id)
+        while len(self._rows) > self.max_size:
+            self._rows.popitem(last=False)
+            self.evictions += 1
+
+@instrumented
+class DBManager(commands.Cog, StorageBackend):
+    """Cog gérant les interactions avec la base de données (backend SQLite)."""
+
+    def __init__(self, bot, profile=None):
         self.bot = bot
+        self.profile = profile or os.environ.get("DB_PROFILE", DEFAULT_DB_PROFILE)
+        self._conn: aiosqlite.Connection | None = None
+        # File des écritures : (job, future) consommée par un unique écrivain
+        self._write_queue: asyncio.Queue = asyncio.Queue()
+        self._writer_task: asyncio.Task | None = None
+        # Callbacks `callback(committed)` exécutés à la fin de chaque lot, avant de réveiller les appelants ;
+        # ceux d'un job annulé par son savepoint reçoivent committed=False
+        self._after_batch: list = []
+        self._user_cache = UserCache()
+        # Même mécanique pour les inventaires : user_id -> {item_id: quantité}
+        self._inventory_cache = UserCache(INVENTORY_CACHE_SIZE)
+        # Pool de lecture : une connexion en lecture seule par thread
+        self._read_executor: ThreadPoolExecutor | None = None
+        self._read_local = threading.local()
+        self._read_conns: list[sqlite3.Connection] = []
+        # Gains (argent, niveau) accumulés en mémoire par utilisateur, en attente d'écriture
+        self._pending_rewards: dict[int, list] = {}
+        # Gains retirés de _pending_rewards mais pas encore visibles en base
+        self._flushing_rewards: dict[int, list] = {}
+        # Sources de gains accumulés hors base (ex. temps en vocal), voir add_reward_settler
+        self._reward_settlers: list = []
 
     async def cog_load(self):
         """Méthode appelée automatiquement lors du chargement du Cog."""
-        self.create_db();
+        # Les mutations atomiques reposent sur UPSERT ... RETURNING
+        if sqlite3.sqlite_version_info < (3, 35, 0):
+            raise RuntimeError(f"❌ SQLite >= 3.35 requis (version installée : {sqlite3.sqlite_version})")
+        if self.profile not in DB_PROFILES:
+            raise RuntimeError(f"❌ Profil SQLite inconnu : `{self.profile}` (disponibles : {', '.join(DB_PROFILES)})")
+
+        # Une seule connexion longue durée, exécutée dans le thread d'aiosqlite.
+        # Transactions gérées explicitement par l'écrivain (isolation_level=None).
+        self._conn = await aiosqlite.connect(DB_PATH, isolation_level=None)
+        for pragma in self._profile_pragmas():
+            await self._conn.execute(pragma)
+        await self._report_profile()
+        self._read_executor = ThreadPoolExecutor(max_workers=READ_POOL_SIZE, thread_name_prefix="db-read")
+        self._writer_task = asyncio.create_task(self._writer_loop())
+        await self.create_db()
+        self.flush_rewards_periodically.start()
+        self.compact_ledger_periodically.start()
+
+    async def cog_unload(self):
+        """Écrit les gains en attente, arrête l'écrivain puis ferme la connexion."""
+        self.flush_rewards_periodically.cancel()
+        self.compact_ledger_periodically.cancel()
+        if self._conn is not None:
+            self._settle_rewards()
+            await self.flush_rewards()
+            await self._write_queue.put(None)
+            await self._writer_task
+            self._read_executor.shutdown(wait=True)
+            for conn in self._read_conns:
+                conn.close()
+            self._read_conns.clear()
+            await self._conn.close()
+            self._conn = None
+
+    # Profil de performance
+    def _profile_pragmas(self, read_only=False):
+        """Retourne les instructions PRAGMA du profil courant."""
+        pragmas = []
+        for name, value in DB_PROFILES[self.profile].items():
+            # Le mode de journal est propre au fichier : une connexion en lecture seule ne peut pas le changer
+            if read_only and name == "journal_mode":
+                continue
+            pragmas.append(f"PRAGMA {name}={value}")
+        return pragmas
+
+    async def _report_profile(self):
+        """Affiche les pragmas effectivement appliqués sur la connexion d'écriture."""
+        effective = []
+        for name in DB_PROFILES[self.profile]:
+            async with self._conn.execute(f"PRAGMA {name}") as cursor:
+                effective.append(f"{name}={(await cursor.fetchone())[0]}")
+        print(f"⚙️ Profil SQLite `{self.profile}` : {', '.join(effective)}")
+
+    # Pool de lecture
+    def _read_conn(self):
+        """Retourne la connexion en lecture seule du thread courant (ouverte à la demande)."""
+        conn = getattr(self._read_local, "conn", None)
+        if conn is None:
+            uri = f"{Path(DB_PATH).resolve().as_uri()}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            for pragma in self._profile_pragmas(read_only=True):
+                conn.execute(pragma)
+            self._read_local.conn = conn
+            self._read_conns.append(conn)
+        return conn
+
+    async def _read(self, query, params=(), one=False):
+        """Exécute une requête en lecture seule dans le pool, sans bloquer la boucle d'évènements."""
+        def run():
+            cursor = self._read_conn().execute(query, params)
+            try:
+                return cursor.fetchone() if one else cursor.fetchall()
+            finally:
+                # Un curseur laissé ouvert garderait un instantané (transaction de lecture) périmé
+                cursor.close()
+
+        return await asyncio.get_running_loop().run_in_executor(self._read_executor, run)
+
+    # Écrivain unique avec commit groupé
+    async def _write(self, job):
+        """Soumet une écriture à l'écrivain et attend qu'elle soit commitée.
 
-    def drop_db(self):
+        `job` est une coroutine `job(conn)` ; sa valeur de retour est renvoyée
+        à l'appelant, ses erreurs SQLite lui sont propagées.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((job, future))
+        return await future
+
+    async def _writer_loop(self):
+        """Vide la file des écritures et commite chaque lot en une seule transaction."""
+        while True:
+            batch = [await self._write_queue.get()]
+            while len(batch) < WRITE_BATCH_MAX and not self._write_queue.empty():
+                batch.append(self._write_queue.get_nowait())
+            jobs = [entry for entry in batch if entry is not None]
+
+            outcomes = []
+            # Callbacks des jobs annulés par ROLLBACK TO : appelés avec committed=False
+            rolled_back = []
+            committed = False
+            try:
+                await self._conn.execute("BEGIN IMMEDIATE")
+                for job, future in jobs:
+                    # Un savepoint par écriture : un échec n'annule pas tout le lot
+                    await self._conn.execute("SAVEPOINT job")
+                    first_callback = len(self._after_batch)
+                    try:
+                        outcomes.append((future, await job(self._conn), None))
+                    except Exception as e:
+                        await self._conn.execute("ROLLBACK TO job")
+                        rolled_back.extend(self._after_batch[first_callback:])
+                        del self._after_batch[first_callback:]
+                        outcomes.append((future, None, e))
+                    await self._conn.execute("RELEASE job")
+                await self._conn.execute("COMMIT")
+                committed = True
+            except sqlite3.Error as e:
+                # Commit impossible : aucune écriture du lot n'est appliquée
+                if self._conn.in_transaction:
+                    await self._conn.execute("ROLLBACK")
+                outcomes = [(future, None, e) for _, future in jobs]
+
+            for callback in self._after_batch:
+                callback(committed)
+            self._after_batch.clear()
+            for callback in rolled_back:
+                callback(False)
+
+            for future, result, error in outcomes:
+                if future.cancelled():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+            if len(jobs) != len(batch):
+                return  # Sentinelle reçue : arrêt de l'écrivain
+
+    async def drop_db(self):
         """Drope la table users si elle existe."""
+        async def job(conn):
+            await conn.execute("DROP TABLE IF EXIST users")
+
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute("DROP TABLE IF EXIST users")
-                print("✅ Table `users` droppée si existante avec succès.")
+            await self._write(job)
+            print("✅ Table `users` droppée si existante avec succès.")
         except sqlite3.Error as e:
-            print(f"⚠️ Erreur lors de la vérification d'existance/drop de la tale `users` : {e}")
+            db_error(f"⚠️ Erreur lors de la vérification d'existance/drop de la tale `users` : {e}")
 
-    def create_db(self):
-        """Crée la table users si elle n'existe pas."""
+    async def create_db(self):
+        """Met le schéma à jour en appliquant les migrations manquantes."""
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT NOT NULL,
-                    argent INTEGER DEFAULT 500,
-                    niveau INTEGER DEFAULT 0,
-                    discriminator TEXT,
-                    joined_at TEXT,
-                    roles TEXT
-                )
-                ''')
-                
-                # Table des items - vérifier et ajouter la colonne description si elle n'existe pas
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS items (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT NOT NULL,
-                        price INTEGER NOT NULL
-                    )
-                ''')
-                
-                # Ajouter la colonne description si elle n'existe pas
-                try:
-                    cursor.execute("ALTER TABLE items ADD COLUMN description TEXT DEFAULT ''")
-                    print("✅ Colonne description ajoutée à la table items.")
-                except sqlite3.OperationalError:
-                    # La colonne existe déjà, c'est normal
-                    pass
-
-                # Table des achats
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS purchases (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        item_id INTEGER,
-                        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
+            # Cas courant : une seule lecture quand le schéma est déjà à jour
+            current = await self._schema_version()
+            if current >= LATEST_VERSION:
+                print(f"✅ Schéma de la base à jour (version {current}).")
+                return
 
-                
-
-                # Nettoyer d'abord tous les doublons existants
-                cursor.execute("""
-                    DELETE FROM items WHERE id NOT IN (
-                        SELECT MIN(id) FROM items GROUP BY name, price
+            async def job(conn):
+                await conn.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT,
+                        applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
                     )
                 """)
-                
-                # Ajouter les items par défaut seulement s'ils n'existent pas déjà
-                default_items = [
-                    ("Roulette russe", 200, "Un jeu dangereux qui peut vous faire gagner ou perdre gros !"),
-                    ("VIP", 500000, "Accès VIP au serveur avec des privilèges exclusifs")
-                ]
-                
-                for item_name, item_price, item_desc in default_items:
-                    cursor.execute("SELECT COUNT(*) FROM items WHERE name = ? AND price = ?", (item_name, item_price))
-                    if cursor.fetchone()[0] == 0:
-                        cursor.execute("INSERT INTO items (name, price, description) VALUES (?, ?, ?)", (item_name, item_price, item_desc))
-
-                conn.commit()
-                print("Base de données initialisée avec succès.")
-                print("✅ Table `users` vérifiée/créée avec succès.")
+                async with conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version") as cursor:
+                    version = (await cursor.fetchone())[0]
+                applied = []
+                for migration_version, description, migrate in MIGRATIONS:
+                    if migration_version > version:
+                        await migrate(conn)
+                        await conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                                           (migration_version, description))
+                        applied.append(f"{migration_version} ({description})")
+                return applied
+
+            for migration in await self._write(job):
+                print(f"✅ Migration {migration} appliquée.")
+            print(f"Base de données initialisée avec succès (version {LATEST_VERSION}).")
         except sqlite3.Error as e:
-            print(f"⚠️ Erreur lors de la création de la base : {e}")
+            db_error(f"⚠️ Erreur lors de la création de la base : {e}")
+
+    async def _schema_version(self):
+        """Retourne la version du schéma (0 pour une base sans table schema_version)."""
+        try:
+            result = await self._read("SELECT MAX(version) FROM schema_version", one=True)
+        except sqlite3.OperationalError:
+            return 0
+        return result[0] or 0
+
+    # Cache utilisateur
+    def _cache_on_commit(self, user_id, row):
+        """Écrit la ligne dans le cache une fois le lot validé (l'invalide sinon)."""
+        def callback(committed):
+            if committed:
+                self._user_cache.write(user_id, row)
+            else:
+                self._user_cache.discard(user_id)
+
+        self._after_batch.append(callback)
+
+    async def _user_row(self, user_id):
+        """Retourne (argent, niveau) validés en base, ou None si l'utilisateur n'existe pas."""
+        hit, row = self._user_cache.get(user_id)
+        if hit:
+            return row
+        generation = self._user_cache.generation
+        row = await self._read("SELECT argent, niveau FROM users WHERE user_id = ?", (user_id,), one=True)
+        self._user_cache.fill(user_id, row, generation)
+        return row
+
+    def user_cache_stats(self):
+        """Retourne les compteurs du cache utilisateur (taille, hits, misses, évictions)."""
+        return self._user_cache.stats()
+
+    def _pending_for(self, user_id):
+        """Retourne les gains (argent, niveau) pas encore visibles des lectures du pool.
+
+        Réservé aux lectures : un lot de flush en cours est compté tant qu'il n'est pas commité.
+        """
+        self._settle_rewards(user_id)
+        money = xp = 0
+        for pending in (self._pending_rewards.get(user_id), self._flushing_rewards.get(user_id)):
+            if pending:
+                money += pending[0]
+                xp += pending[1]
+        return money, xp
+
+    def _queued_for(self, user_id):
+        """Retourne les gains (argent, niveau) pas encore écrits, vus depuis un job de l'écrivain.
+
+        La connexion d'écriture voit déjà les flushs exécutés plus tôt (même non commités) :
+        seuls les gains encore dans _pending_rewards s'ajoutent à la ligne users.
+        """
+        self._settle_rewards(user_id)
+        return tuple(self._pending_rewards.get(user_id, (0, 0)))
 
     # Obtenir la balance (argent) d'un utilisateur
-    def user_get_balance(self, user_id):
-        """Obtenir la balance (argent) d'un utilisateur"""
+    async def user_get_balance(self, user_id):
+        """Obtenir la balance (argent, en millièmes) d'un utilisateur, gains en attente compris."""
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT argent FROM users WHERE user_id = ?", (user_id,))
-                result = cursor.fetchone()
-                if result:
-                    return result[0]
-                else:
-                    print(f"⚠️ Erreur lors de la récupération du user id=`{user_id}`")
-                    return None
+            result = await self._user_row(user_id)
+            pending_money, _ = self._pending_for(user_id)
+            if result:
+                return result[0] + pending_money
+            elif user_id in self._pending_rewards or user_id in self._flushing_rewards:
+                # Utilisateur pas encore écrit : il sera créé au prochain flush
+                return DEFAULT_ARGENT + pending_money
+            else:
+                print(f"⚠️ Erreur lors de la récupération du user id=`{user_id}`")
+                return None
         except sqlite3.Error as e:
-            print(f"Erreur SQLite : {e}")
+            db_error(f"Erreur SQLite : {e}")
             return None
 
     # Ajouter de l'argent à un utilisateur
-    def user_add_balance(self, user_id, amount):
-        """Ajouter de l'argent à un utilisateur."""
+    async def user_add_balance(self, user_id, amount, reason="ajustement", ref=None):
+        """Ajouter de l'argent (`amount` en millièmes) à un utilisateur (créé s'il n'existe pas).
+
+        `reason` et `ref` (ex. "poker:<id>") sont consignés dans le journal des transactions.
+        """
+        async def job(conn):
+            await self._open_accounts(conn, [user_id])
+            # Une seule instruction atomique : pas de mise à jour perdue entre appels concurrents
+            cursor = await conn.execute("UPDATE users SET argent = argent + ? WHERE user_id = ? RETURNING argent, niveau",
+                                        (amount, user_id))
+            row = await cursor.fetchone()
+            await self._ledger(conn, [(user_id, amount, 0)], reason, ref)
+            self._cache_on_commit(user_id, row)
+            return row[0] + self._queued_for(user_id)[0]
+
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT argent FROM users WHERE user_id = ?", (user_id,))
-                result = cursor.fetchone()
-                if result:
-                    new_balance = result[0] + amount
-                    cursor.execute("UPDATE users SET argent = ? WHERE user_id = ?", (new_balance, user_id))
-                    conn.commit()
-                    return new_balance
-                else:
-                    print(f"⚠️ Erreur lors de la récupération du user id=`{user_id}`")
-                    return None
+            return await self._write(job)
+        except sqlite3.Error as e:
+            db_error(f"Erreur SQLite : {e}")
+            return None
+
+    async def _open_accounts(self, conn, user_ids):
+        """Crée dans un job de l'écrivain les comptes absents, avec les valeurs par défaut.
+
+        Le trigger users_ledger_opening journalise le solde d'ouverture de chaque compte créé.
+        """
+        await conn.executemany("""
+            INSERT INTO users (user_id, username, argent, niveau) VALUES (?, ?, ?, 0)
+            ON CONFLICT(user_id) DO NOTHING
+        """, [(user_id, f"User_{user_id}", DEFAULT_ARGENT) for user_id in user_ids])
+
+    async def _debit(self, conn, user_id, amount):
+        """Débite `amount` dans un job de l'écrivain si le solde (gains en attente compris) suffit.
+
+        Retourne (débité, ligne (argent, niveau) après l'opération) ; l'utilisateur est créé au besoin.
+        """
+        pending_money = self._queued_for(user_id)[0]
+        await self._open_accounts(conn, [user_id])
+        cursor = await conn.execute("""
+            UPDATE users SET argent = argent - ?
+            WHERE user_id = ? AND argent + ? >= ?
+            RETURNING argent, niveau
+        """, (amount, user_id, pending_money, amount))
+        row = await cursor.fetchone()
+        if row is not None:
+            return True, row
+        async with conn.execute("SELECT argent, niveau FROM users WHERE user_id = ?", (user_id,)) as cursor:
+            return False, await cursor.fetchone()
+
+    # Dépenser de l'argent si le solde suffit
+    async def user_spend_balance(self, user_id, amount, reason="depense", ref=None):
+        """Débite `amount` (en millièmes) seulement si le solde suffit, contrôle et débit en une instruction."""
+        async def job(conn):
+            spent, row = await self._debit(conn, user_id, amount)
+            if spent:
+                await self._ledger(conn, [(user_id, -amount, 0)], reason, ref)
+            self._cache_on_commit(user_id, row)
+            return spent, row[0] + self._queued_for(user_id)[0]
+
+        try:
+            return await self._write(job)
+        except sqlite3.Error as e:
+            db_error(f"Erreur SQLite : {e}")
+            return None
+
+    # Transférer de l'argent entre deux utilisateurs
+    async def user_transfer_balance(self, from_id, to_id, amount,
+                                    sent_reason="don_envoye", received_reason="don_recu"):
+        """Transfère `amount` (en millièmes) si le solde de `from_id` suffit : débit et crédit dans le même job."""
+        async def job(conn):
+            spent, from_row = await self._debit(conn, from_id, amount)
+            self._cache_on_commit(from_id, from_row)
+            from_balance = from_row[0] + self._queued_for(from_id)[0]
+            if not spent:
+                return False, from_balance, None
+            await self._open_accounts(conn, [to_id])
+            cursor = await conn.execute("UPDATE users SET argent = argent + ? WHERE user_id = ? RETURNING argent, niveau",
+                                        (amount, to_id))
+            to_row = await cursor.fetchone()
+            await self._ledger(conn, [(from_id, -amount, 0)], sent_reason, f"user:{to_id}")
+            await self._ledger(conn, [(to_id, amount, 0)], received_reason, f"user:{from_id}")
+            self._cache_on_commit(to_id, to_row)
+            return True, from_balance, to_row[0] + self._queued_for(to_id)[0]
+
+        try:
+            return await self._write(job)
         except sqlite3.Error as e:
-            print(f"Erreur SQLite : {e}")
+            db_error(f"Erreur SQLite : {e}")
             return None
 
     # Reset l'argent d'un utilisateur
-    def user_reset_balance(self, user_id):
-        """Reset l'argent d'un utilisateur."""
+    async def user_reset_balance(self, user_id, reason="reset", ref=None):
+        """Reset l'argent d'un utilisateur (créé s'il n'existe pas)."""
+        async def job(conn):
+            # Ancien solde lu dans la transaction de l'écrivain, pour le journal
+            async with conn.execute("SELECT argent FROM users WHERE user_id = ?", (user_id,)) as cursor:
+                old = await cursor.fetchone()
+            cursor = await conn.execute("""
+                INSERT INTO users (user_id, username, argent) VALUES (?, ?, 0)
+                ON CONFLICT(user_id) DO UPDATE SET argent = 0
+                RETURNING argent, niveau
+            """, (user_id, f"User_{user_id}"))
+            row = await cursor.fetchone()
+            if old:
+                await self._ledger(conn, [(user_id, -old[0], 0)], reason, ref)
+            self._cache_on_commit(user_id, row)
+            new_balance = row[0]
+            # Les gains en attente sont remis à zéro avec le solde
+            self._settle_rewards(user_id)
+            if user_id in self._pending_rewards:
+                self._pending_rewards[user_id][0] = 0
+            return new_balance
+
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT argent FROM users WHERE user_id = ?", (user_id,))
-                result = cursor.fetchone()
-                if result:
-                    cursor.execute("UPDATE users SET argent = ? WHERE user_id = ?", (0, user_id))
-                    conn.commit()
-                    return 0
-                else:
-                    print(f"⚠️ Erreur lors de la récupération du user id=`{user_id}`")
-                    return None
+            return await self._write(job)
         except sqlite3.Error as e:
-            print(f"Erreur SQLite : {e}")
+            db_error(f"Erreur SQLite : {e}")
             return None
 
     # Obtenir le niveau d'un utilisateur
-    def user_get_niveau(self, user_id):
-        """Retourne le niveau d'un utilisateur."""
+    async def user_get_niveau(self, user_id):
+        """Retourne le niveau (en millièmes) d'un utilisateur, gains en attente compris."""
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT niveau FROM users WHERE user_id = ?", (user_id,))
-                result = cursor.fetchone()
-                if result:
-                    return result[0]
-                else:
-                    print(f"⚠️ Erreur lors de la récupération du user id=`{user_id}`")
-                    return None
+            result = await self._user_row(user_id)
+            _, pending_xp = self._pending_for(user_id)
+            if result:
+                return result[1] + pending_xp
+            elif user_id in self._pending_rewards or user_id in self._flushing_rewards:
+                return pending_xp
+            else:
+                print(f"⚠️ Erreur lors de la récupération du user id=`{user_id}`")
+                return None
         except sqlite3.Error as e:
-            print(f"Erreur SQLite : {e}")
+            db_error(f"Erreur SQLite : {e}")
             return None
 
     # Ajouter des niveaux à un utilisateur
-    def user_add_niveau(self, user_id, amount):
-        """Ajoute des niveaux à un utilisateur."""
+    async def user_add_niveau(self, user_id, amount, reason="ajustement", ref=None):
+        """Ajoute des niveaux à un utilisateur (créé s'il n'existe pas)."""
+        async def job(conn):
+            await self._open_accounts(conn, [user_id])
+            cursor = await conn.execute("UPDATE users SET niveau = niveau + ? WHERE user_id = ? RETURNING argent, niveau",
+                                        (amount, user_id))
+            row = await cursor.fetchone()
+            await self._ledger(conn, [(user_id, 0, amount)], reason, ref)
+            self._cache_on_commit(user_id, row)
+            return row[1] + self._queued_for(user_id)[1]
+
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT niveau FROM users WHERE user_id = ?", (user_id,))
-                result = cursor.fetchone()
-
-                if result:
-                    new_niveau = result[0] + amount
-                    cursor.execute("UPDATE users SET niveau = ? WHERE user_id = ?", (new_niveau, user_id))
-                    conn.commit()
-                    return new_niveau
-                else:
-                    print(f"⚠️ Erreur lors de la récupération du user id=`{user_id}`")
-                    return None
+            return await self._write(job)
         except sqlite3.Error as e:
-            print(f"Erreur SQLite : {e}")
+            db_error(f"Erreur SQLite : {e}")
             return None
 
     # Reset le niveau d'un utilisateur
-    def user_reset_niveau(self, user_id):
-        """Reset le niveau d'un utilisateur."""
+    async def user_reset_niveau(self, user_id, reason="reset", ref=None):
+        """Reset le niveau d'un utilisateur (créé s'il n'existe pas)."""
+        async def job(conn):
+            async with conn.execute("SELECT niveau FROM users WHERE user_id = ?", (user_id,)) as cursor:
+                old = await cursor.fetchone()
+            cursor = await conn.execute("""
+                INSERT INTO users (user_id, username, niveau) VALUES (?, ?, 0)
+                ON CONFLICT(user_id) DO UPDATE SET niveau = 0
+                RETURNING argent, niveau
+            """, (user_id, f"User_{user_id}"))
+            row = await cursor.fetchone()
+            if old:
+                await self._ledger(conn, [(user_id, 0, -old[0])], reason, ref)
+            self._cache_on_commit(user_id, row)
+            new_niveau = row[1]
+            self._settle_rewards(user_id)
+            if user_id in self._pending_rewards:
+                self._pending_rewards[user_id][1] = 0
+            return new_niveau
+
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT niveau FROM users WHERE user_id = ?", (user_id,))
-                result = cursor.fetchone()
-
-                if result:
-                    new_niveau = 0
-                    cursor.execute("UPDATE users SET niveau = ? WHERE user_id = ?", (new_niveau, user_id))
-                    conn.commit()
-                    return new_niveau
-                else:
-                    print(f"⚠️ Erreur lors de la récupération du user id=`{user_id}`")
-                    return None
+            return await self._write(job)
         except sqlite3.Error as e:
-            print(f"Erreur SQLite : {e}")
+            db_error(f"Erreur SQLite : {e}")
             return None
 
+    # Gains différés (messages, vocal)
+    def user_queue_reward(self, user_id, money=0, xp=0):
+        """Accumule un gain (en millièmes) en mémoire ; il sera écrit en base au prochain flush."""
+        pending = self._pending_rewards.setdefault(user_id, [0, 0])
+        pending[0] += money
+        pending[1] += xp
+
+    def add_reward_settler(self, settler):
+        """Enregistre une source de gains accumulés hors base (voir StorageBackend)."""
+        self._reward_settlers.append(settler)
+
+    def remove_reward_settler(self, settler):
+        """Retire une source de gains enregistrée par add_reward_settler."""
+        if settler in self._reward_settlers:
+            self._reward_settlers.remove(settler)
+
+    def _settle_rewards(self, user_id=None):
+        """Fait verser aux sources leurs gains accumulés pour `user_id` (None : tous)."""
+        for settler in self._reward_settlers:
+            settler(user_id)
+
+    async def flush_rewards(self):
+        """Écrit tous les gains en attente en une seule transaction."""
+        if not self._pending_rewards:
+            return
+
+        flushed = {}
+
+        async def job(conn):
+            # Prise du lot au moment où l'écrivain l'exécute, dans l'ordre des autres écritures
+            pending, self._pending_rewards = self._pending_rewards, {}
+            flushed.update(pending)
+            # Les lectures du pool ne voient le lot qu'après le commit : le garder visible jusque-là
+            for user_id, (money, xp) in pending.items():
+                flushing = self._flushing_rewards.setdefault(user_id, [0, 0])
+                flushing[0] += money
+                flushing[1] += xp
+            self._after_batch.append(lambda committed: self._apply_flushed(pending, committed))
+            await self._upsert_deltas(conn, pending)
+            await self._ledger(conn, [(user_id, money, xp) for user_id, (money, xp) in pending.items()], "recompense")
+
+        try:
+            await self._write(job)
+        except sqlite3.Error as e:
+            # Remettre les gains en attente pour le prochain essai
+            for user_id, (money, xp) in flushed.items():
+                self.user_queue_reward(user_id, money, xp)
+            db_error(f"⚠️ Erreur lors de l'écriture des gains en attente : {e}")
+
+    def _apply_flushed(self, pending, committed):
+        """Fin du lot d'un flush : les gains sont désormais en base (ou seront remis en attente)."""
+        self._flushing_rewards.clear()
+        self._apply_deltas(pending, committed)
+
+    # Mutations groupées
+    async def _upsert_deltas(self, conn, deltas):
+        """Applique {user_id: [argent, niveau]} en deux executemany (utilisateurs créés au besoin)."""
+        await self._open_accounts(conn, deltas)
+        await conn.executemany("UPDATE users SET argent = argent + ?, niveau = niveau + ? WHERE user_id = ?",
+                               [(money, xp, user_id) for user_id, (money, xp) in deltas.items()])
+
+    def _apply_deltas(self, deltas, committed):
+        """Reporte des deltas validés dans le cache utilisateur."""
+        for user_id, (money, xp) in deltas.items():
+            if committed:
+                self._user_cache.adjust(user_id, money, xp)
+            else:
+                self._user_cache.discard(user_id)
+
+    async def _bulk_add(self, deltas, reason, ref):
+        """Écrit {user_id: [argent, niveau]} en une seule écriture groupée."""
+        if not deltas:
+            return True
+
+        async def job(conn):
+            await self._upsert_deltas(conn, deltas)
+            await self._ledger(conn, [(user_id, money, xp) for user_id, (money, xp) in deltas.items()], reason, ref)
+            self._after_batch.append(lambda committed: self._apply_deltas(deltas, committed))
+
+        try:
+            await self._write(job)
+            return True
+        except sqlite3.Error as e:
+            db_error(f"Erreur SQLite : {e}")
+            return False
+
+    async def bulk_add_balance(self, deltas, reason="ajustement", ref=None):
+        """Ajoute de l'argent à plusieurs utilisateurs en une transaction.
+
+        `deltas` : liste de paires (user_id, montant en millièmes) ; les utilisateurs absents sont créés.
+        """
+        totals = {}
+        for user_id, amount in deltas:
+            totals.setdefault(user_id, [0, 0])[0] += amount
+        return await self._bulk_add(totals, reason, ref)
+
+    async def bulk_add_niveau(self, deltas, reason="ajustement", ref=None):
+        """Ajoute des niveaux à plusieurs utilisateurs en une transaction.
+
+        `deltas` : liste de paires (user_id, montant) ; les utilisateurs absents sont créés.
+        """
+        totals = {}
+        for user_id, amount in deltas:
+            totals.setdefault(user_id, [0, 0])[1] += amount
+        return await self._bulk_add(totals, reason, ref)
+
+    async def bulk_ensure_users(self, user_ids):
+        """Crée en une transaction les utilisateurs absents parmi `user_ids`."""
+        missing = []
+        for user_id in set(user_ids):
+            hit, row = self._user_cache.get(user_id)
+            if not (hit and row is not None):
+                missing.append(user_id)
+        if not missing:
+            return True
+
+        async def job(conn):
+            await self._open_accounts(conn, missing)
+            # Un delta nul marque les utilisateurs connus comme existants dans le cache
+            zero = {user_id: [0, 0] for user_id in missing}
+            self._after_batch.append(lambda committed: self._apply_deltas(zero, committed))
+
+        try:
+            await self._write(job)
+            return True
+        except sqlite3.Error as e:
+            db_error(f"Erreur SQLite : {e}")
+            return False
+
+    @tasks.loop(seconds=REWARDS_FLUSH_INTERVAL)
+    async def flush_rewards_periodically(self):
+        await self.flush_rewards()
+
+    # Journal des transactions
+    async def _ledger(self, conn, entries, reason, ref=None):
+        """Ajoute au journal les entrées (user_id, delta_argent, delta_niveau) non nulles."""
+        rows = [(user_id, money, xp, reason, ref) for user_id, money, xp in entries if money or xp]
+        if rows:
+            await conn.executemany(
+                "INSERT INTO ledger (user_id, argent, niveau, reason, ref) VALUES (?, ?, ?, ?, ?)", rows)
+
+    async def get_user_ledger(self, user_id, limit=20):
+        """Retourne les dernières entrées du journal d'un utilisateur (plus récentes d'abord)."""
+        try:
+            return await self._read("""
+                SELECT argent, niveau, reason, ref, created_at
+                FROM ledger
+                WHERE user_id = ?
+                ORDER BY id DESC
+                LIMIT ?
+            """, (user_id, limit))
+        except sqlite3.Error as e:
+            db_error(f"Erreur SQLite : {e}")
+            return []
+
+    async def compact_ledger(self, retention_days=LEDGER_RETENTION_DAYS):
+        """Replie les entrées plus anciennes que `retention_days` dans ledger_snapshots.
+
+        L'instantané d'un utilisateur est son solde juste après la dernière entrée
+        repliée : solde courant moins la somme des entrées conservées.
+        """
+        async def job(conn):
+            async with conn.execute("SELECT MAX(id) FROM ledger WHERE created_at < datetime('now', ?)",
+                                    (f"-{retention_days} days",)) as cursor:
+                cutoff = (await cursor.fetchone())[0]
+            if cutoff is None:
+                return 0
+            await conn.execute("""
+                INSERT INTO ledger_snapshots (user_id, argent, niveau, last_ledger_id)
+                SELECT users.user_id,
+                       users.argent - COALESCE(SUM(recent.argent), 0),
+                       users.niveau - COALESCE(SUM(recent.niveau), 0),
+                       ?
+                FROM users
+                LEFT JOIN ledger AS recent ON recent.user_id = users.user_id AND recent.id > ?
+                WHERE users.user_id IN (SELECT user_id FROM ledger WHERE id <= ?)
+                GROUP BY users.user_id
+                ON CONFLICT(user_id) DO UPDATE SET
+                    argent = excluded.argent,
+                    niveau = excluded.niveau,
+                    last_ledger_id = excluded.last_ledger_id,
+                    taken_at = CURRENT_TIMESTAMP
+            """, (cutoff, cutoff, cutoff))
+            cursor = await conn.execute("DELETE FROM ledger WHERE id <= ?", (cutoff,))
+            return cursor.rowcount
+
+        try:
+            folded = await self._write(job)
+            if folded:
+                print(f"🧾 Journal compacté : {folded} entrée(s) repliée(s) dans les instantanés.")
+            return folded
+        except sqlite3.Error as e:
+            db_error(f"⚠️ Erreur lors de la compaction du journal : {e}")
+            return 0
+
+    @tasks.loop(hours=LEDGER_COMPACTION_INTERVAL)
+    async def compact_ledger_periodically(self):
+        await self.compact_ledger()
+
     # Créer un utilisateur s'il n'existe pas
-    def user_ensure_exist(self, member: discord.Member):
+    async def user_ensure_exist(self, member: discord.Member):
         """Ajoute un utilisateur dans la base de données s'il n'existe pas."""
-        try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (member.id,))
-                if cursor.fetchone() is None:
-                    roles = ", ".join([role.name for role in member.roles if role.name != "@everyone"])
-                    cursor.execute("INSERT INTO users (user_id, username, discriminator, joined_at, roles) VALUES (?, ?, ?, ?, ?)",
+        hit, row = self._user_cache.get(member.id)
+        if hit and row is not None:
+            return
+
+        async def job(conn):
+            cursor = await conn.execute("SELECT user_id FROM users WHERE user_id = ?", (member.id,))
+            if await cursor.fetchone() is None:
+                roles = ", ".join([role.name for role in member.roles if role.name != "@everyone"])
+                await conn.execute("INSERT INTO users (user_id, username, discriminator, joined_at, roles) VALUES (?, ?, ?, ?, ?)",
                                    (member.id, member.name, member.discriminator, str(member.joined_at), roles))
-                    conn.commit()
+                self._cache_on_commit(member.id, (DEFAULT_ARGENT, 0))
+
+        try:
+            await self._write(job)
         except sqlite3.Error as e:
-            print(f"Erreur SQLite : {e}")
+            db_error(f"Erreur SQLite : {e}")
 
     # Créer un utilisateur simple
-    def user_create(self, user_id):
+    async def user_create(self, user_id):
         """Crée un utilisateur avec les valeurs par défaut."""
+        hit, row = self._user_cache.get(user_id)
+        if hit and row is not None:
+            return
+
+        async def job(conn):
+            cursor = await conn.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
+            if await cursor.fetchone() is None:
+                await conn.execute("INSERT INTO users (user_id, username, argent, niveau) VALUES (?, ?, ?, ?)",
+                                   (user_id, f"User_{user_id}", DEFAULT_ARGENT, 0))
+                self._cache_on_commit(user_id, (DEFAULT_ARGENT, 0))
+                return True
+            return False
+
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-                if cursor.fetchone() is None:
-                    cursor.execute("INSERT INTO users (user_id, username, argent, niveau) VALUES (?, ?, ?, ?)",
-                                   (user_id, f"User_{user_id}", 500, 0))
-                    conn.commit()
-                    print(f"✅ Utilisateur {user_id} créé avec 500 jetons.")
+            if await self._write(job):
+                print(f"✅ Utilisateur {user_id} créé avec {format_milli(DEFAULT_ARGENT)} jetons.")
         except sqlite3.Error as e:
-            print(f"Erreur SQLite : {e}")
+            db_error(f"Erreur SQLite : {e}")
 
     # Méthodes pour la boutique
-    def get_all_items(self):
+    async def get_all_items(self):
         """Retourne tous les articles de la boutique."""
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, name, price, description FROM items")
-                return cursor.fetchall()
+            return await self._read("SELECT id, name, price, description FROM items")
         except sqlite3.Error as e:
-            print(f"Erreur SQLite : {e}")
+            db_error(f"Erreur SQLite : {e}")
             return []
 
-    def get_item(self, item_id):
+    async def get_item(self, item_id):
         """Retourne les informations d'un article."""
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT name, price, description FROM items WHERE id = ?", (item_id,))
-                return cursor.fetchone()
+            return await self._read("SELECT name, price, description FROM items WHERE id = ?", (item_id,), one=True)
         except sqlite3.Error as e:
-            print(f"Erreur SQLite : {e}")
+            db_error(f"Erreur SQLite : {e}")
             return None
 
-    def add_item(self, name, price, description=""):
+    async def get_items_page(self, sort="price", after=None, limit=20):
+        """Retourne une page du catalogue triée par `sort` ("price" ou "name") puis par id.
+
+        Pagination par clé sur les index idx_items_price / idx_items_name : le coût
+        d'une page ne dépend pas de sa position dans le catalogue.
+        """
+        if sort not in ITEM_SORTS:
+            raise ValueError(f"Tri inconnu : {sort}")
+        cursor_filter = f"WHERE ({sort}, id) > (?, ?)" if after else ""
+        params = (*after, limit) if after else (limit,)
+        try:
+            return await self._read(f"""
+                SELECT id, name, price, description
+                FROM items
+                {cursor_filter}
+                ORDER BY {sort}, id
+                LIMIT ?
+            """, params)
+        except sqlite3.Error as e:
+            db_error(f"Erreur SQLite : {e}")
+            return []
+
+    async def search_items(self, text, limit=10):
+        """Recherche plein texte dans le catalogue (table FTS5 items_fts), classée par bm25."""
+        # Mots découpés comme le tokenizer (même découpage que le backend mémoire), chacun
+        # devenu un préfixe entre guillemets : la saisie ne peut pas injecter de syntaxe FTS5
+        terms = search_words(text)
+        if not terms:
+            return []
+        query = " ".join(f'"{term}"*' for term in terms)
+        try:
+            # Une correspondance dans le nom pèse plus qu'une correspondance dans la description
+            return await self._read("""
+                SELECT items.id, items.name, items.price, items.description
+                FROM items_fts
+                JOIN items ON items.id = items_fts.rowid
+                WHERE items_fts MATCH ?
+                ORDER BY bm25(items_fts, 10.0, 1.0)
+                LIMIT ?
+            """, (query, limit))
+        except sqlite3.Error as e:
+            db_error(f"Erreur SQLite : {e}")
+            return []
+
+    async def add_item(self, name, price, description=""):
         """Ajoute un article à la boutique."""
+        async def job(conn):
+            await conn.execute("INSERT INTO items (name, price, description) VALUES (?, ?, ?)", (name, price, description))
+
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute("INSERT INTO items (name, price, description) VALUES (?, ?, ?)", (name, price, description))
-                conn.commit()
-                return True
+            await self._write(job)
+            return True
         except sqlite3.Error as e:
-            print(f"Erreur SQLite : {e}")
+            db_error(f"Erreur SQLite : {e}")
             return False
 
-    def remove_item(self, item_id):
+    async def remove_item(self, item_id):
         """Supprime un article de la boutique."""
+        async def job(conn):
+            cursor = await conn.execute("DELETE FROM items WHERE id = ?", (item_id,))
+            return cursor.rowcount > 0
+
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM items WHERE id = ?", (item_id,))
-                conn.commit()
-                return cursor.rowcount > 0
+            return await self._write(job)
         except sqlite3.Error as e:
-            print(f"Erreur SQLite : {e}")
+            db_error(f"Erreur SQLite : {e}")
             return False
 
-    def purchase_item(self, user_id, item_id, price):
-        """Effectue l'achat d'un article."""
+    async def set_item_stock(self, item_id, stock=None, per_user_limit=None):
+        """Fixe le stock et la limite d'achat par utilisateur d'un article (None = illimité)."""
+        async def job(conn):
+            cursor = await conn.execute("UPDATE items SET stock = ?, per_user_limit = ? WHERE id = ?",
+                                        (stock, per_user_limit, item_id))
+            return cursor.rowcount > 0
+
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                # Débiter l'argent de l'utilisateur
-                cursor.execute("UPDATE users SET argent = argent - ? WHERE user_id = ?", (price, user_id))
-                # Enregistrer l'achat
-                cursor.execute("INSERT INTO purchases (user_id, item_id) VALUES (?, ?)", (user_id, item_id))
-                conn.commit()
-                return True
+            return await self._write(job)
         except sqlite3.Error as e:
-            print(f"Erreur SQLite : {e}")
+            db_error(f"Erreur SQLite : {e}")
             return False
 
-    def get_user_purchases(self, user_id):
-        """Retourne l'historique des achats d'un utilisateur."""
+    async def get_item_stock(self, item_id):
+        """Retourne (stock, per_user_limit) d'un article."""
+        try:
+            return await self._read("SELECT stock, per_user_limit FROM items WHERE id = ?", (item_id,), one=True)
+        except sqlite3.Error as e:
+            db_error(f"Erreur SQLite : {e}")
+            return None
+
+    async def purchase(self, user_id, item_id):
+        """Achat atomique d'un article (voir StorageBackend.purchase).
+
+        Lecture du prix, contrôles du stock, de la limite et du solde, débit, décrément
+        du stock et enregistrement sont faits dans un seul job de l'écrivain : deux clics
+        rapides ne peuvent pas dépenser deux fois ni vendre plus que le stock. Les achats
+        simultanés d'une vente flash sont regroupés dans le même lot de l'écrivain.
+        """
+        async def job(conn):
+            async with conn.execute("SELECT name, price, description, stock, per_user_limit FROM items WHERE id = ?",
+                                    (item_id,)) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                return PURCHASE_NO_ITEM, None, None
+            item, stock, per_user_limit = row[:3], row[3], row[4]
+            price = to_milli(item[1])
+            # Les gains en attente font partie du solde affiché : ils comptent pour le contrôle
+            pending_money = self._queued_for(user_id)[0]
+            await self._open_accounts(conn, [user_id])
+
+            status = None
+            if stock is not None and stock <= 0:
+                status = PURCHASE_SOLD_OUT
+            elif per_user_limit is not None:
+                async with conn.execute("SELECT quantity FROM inventory WHERE user_id = ? AND item_id = ?",
+                                        (user_id, item_id)) as cursor:
+                    owned = await cursor.fetchone()
+                if owned is not None and owned[0] >= per_user_limit:
+                    status = PURCHASE_LIMIT_REACHED
+            if status is None:
+                cursor = await conn.execute("""
+                    UPDATE users SET argent = argent - ?
+                    WHERE user_id = ? AND argent + ? >= ?
+                    RETURNING argent, niveau
+                """, (price, user_id, pending_money, price))
+                user = await cursor.fetchone()
+                if user is None:
+                    status = PURCHASE_NO_FUNDS
+            if status is not None:
+                async with conn.execute("SELECT argent, niveau FROM users WHERE user_id = ?", (user_id,)) as cursor:
+                    user = await cursor.fetchone()
+                self._cache_on_commit(user_id, user)
+                return status, user[0] + pending_money, item
+
+            if stock is not None:
+                # Le job est seul sur la connexion d'écriture : le stock lu plus haut est à jour
+                await conn.execute("UPDATE items SET stock = stock - 1 WHERE id = ?", (item_id,))
+            await self._ledger(conn, [(user_id, -price, 0)], "achat", f"item:{item_id}")
+            await conn.execute("INSERT INTO purchases (user_id, item_id) VALUES (?, ?)", (user_id, item_id))
+            await self._add_to_inventory(conn, user_id, item_id)
+            self._cache_on_commit(user_id, user)
+            return PURCHASE_OK, user[0] + pending_money, item
+
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT items.name, purchases.timestamp 
-                    FROM purchases 
-                    JOIN items ON purchases.item_id = items.id 
-                    WHERE purchases.user_id = ?
-                    ORDER BY purchases.timestamp DESC
-                """, (user_id,))
-                return cursor.fetchall()
+            return await self._write(job)
         except sqlite3.Error as e:
-            print(f"Erreur SQLite : {e}")
+            db_error(f"Erreur SQLite : {e}")
+            return None
+
+    # Inventaire
+    async def _add_to_inventory(self, conn, user_id, item_id):
+        """Incrémente l'inventaire dans la transaction d'un achat."""
+        await conn.execute("""
+            INSERT INTO inventory (user_id, item_id, quantity) VALUES (?, ?, 1)
+            ON CONFLICT(user_id, item_id) DO UPDATE SET quantity = quantity + 1
+        """, (user_id, item_id))
+        # Invalidé après le lot (validé ou non) : la prochaine lecture recharge l'inventaire
+        self._after_batch.append(lambda committed: self._inventory_cache.discard(user_id))
+
+    async def _owned(self, user_id):
+        """Retourne {item_id: quantité} pour un utilisateur, via le cache d'inventaires."""
+        hit, owned = self._inventory_cache.get(user_id)
+        if hit:
+            return owned
+        generation = self._inventory_cache.generation
+        rows = await self._read("SELECT item_id, quantity FROM inventory WHERE user_id = ?", (user_id,))
+        owned = dict(rows)
+        self._inventory_cache.fill(user_id, owned, generation)
+        return owned
+
+    async def get_inventory(self, user_id):
+        """Retourne l'inventaire (item_id, nom, quantité) d'un utilisateur."""
+        try:
+            return await self._read("""
+                SELECT items.id, items.name, inventory.quantity
+                FROM inventory
+                JOIN items ON inventory.item_id = items.id
+                WHERE inventory.user_id = ? AND inventory.quantity > 0
+                ORDER BY items.name
+            """, (user_id,))
+        except sqlite3.Error as e:
+            db_error(f"Erreur SQLite : {e}")
             return []
 
-    
+    async def user_owns_item(self, user_id, item_id):
+        """Indique si l'utilisateur possède l'article (dictionnaire en cache après la première lecture)."""
+        try:
+            return (await self._owned(user_id)).get(item_id, 0) > 0
+        except sqlite3.Error as e:
+            db_error(f"Erreur SQLite : {e}")
+            return False
+
+    async def get_item_id(self, name):
+        """Retourne l'id du premier article portant ce nom (index idx_items_name)."""
+        try:
+            result = await self._read("SELECT MIN(id) FROM items WHERE name = ?", (name,), one=True)
+            return result[0]
+        except sqlite3.Error as e:
+            db_error(f"Erreur SQLite : {e}")
+            return None
+
+    async def get_user_purchases(self, user_id, before=None, limit=PURCHASES_PAGE_SIZE):
+        """Retourne une page de l'historique des achats d'un utilisateur, plus récents d'abord.
+
+        Pagination par clé : `before` est le curseur (timestamp, id) du dernier achat
+        de la page précédente, None pour la première page. Chaque ligne est
+        (id, nom de l'article, timestamp).
+        """
+        # (timestamp, id) < (?, ?) reste dans l'index idx_purchases_user_time : pas d'OFFSET ni de tri
+        cursor_filter = "AND (purchases.timestamp, purchases.id) < (?, ?)" if before else ""
+        params = (user_id, *before, limit) if before else (user_id, limit)
+        try:
+            return await self._read(f"""
+                SELECT purchases.id, items.name, purchases.timestamp
+                FROM purchases
+                JOIN items ON purchases.item_id = items.id
+                WHERE purchases.user_id = ? {cursor_filter}
+                ORDER BY purchases.timestamp DESC, purchases.id DESC
+                LIMIT ?
+            """, params)
+        except sqlite3.Error as e:
+            db_error(f"Erreur SQLite : {e}")
+            return []
+
+
 
 async def setup(bot):
     """Ajoute le Cog au bot."""
@@ -0,0 +1,441 @@
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+import discord
+from discord.ext import commands, tasks
+from db_migrations import DEFAULT_ITEMS
+from db_metrics import instrumented
+from fixed_point import format_milli, to_milli
+from storage import (DEFAULT_ARGENT, ITEM_SORTS, LEDGER_COMPACTION_INTERVAL, LEDGER_RETENTION_DAYS,
+                     PURCHASE_LIMIT_REACHED, PURCHASE_NO_FUNDS, PURCHASE_NO_ITEM, PURCHASE_OK, PURCHASE_SOLD_OUT,
+                     PURCHASES_PAGE_SIZE, REWARDS_FLUSH_INTERVAL, StorageBackend, search_words)
+
+
+def _now():
+    """Horodatage au format de CURRENT_TIMESTAMP (UTC, à la seconde)."""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+@instrumented
+class MemoryDBManager(commands.Cog, StorageBackend, name="DBManager"):
+    """Backend de stockage en mémoire, mêmes sémantiques que DBManager (SQLite).
+
+    Rien n'est persisté : destiné aux benchmarks et tests de charge des cogs.
+    Chaque méthode s'exécute sans point d'attente, donc de façon atomique sur la
+    boucle asyncio, comme une transaction de l'écrivain SQLite.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        # user_id -> {"username", "argent", "niveau", "discriminator", "joined_at", "roles"}
+        self._users: dict[int, dict] = {}
+        # item_id -> (name, price, description) ; les ids ne sont jamais réutilisés (AUTOINCREMENT)
+        self._items: dict[int, tuple] = {}
+        self._next_item_id = 1
+        # item_id -> [stock, per_user_limit] pour les articles limités (None = illimité)
+        self._item_stock: dict[int, list] = {}
+        # sort -> clés (valeur du tri, id) triées, reconstruites après un ajout/suppression d'article
+        self._item_keys: dict[str, list] = {}
+        # user_id -> [(id, item_id, timestamp)] dans l'ordre d'insertion
+        self._purchases: dict[int, list] = {}
+        self._next_purchase_id = 1
+        # user_id -> {item_id: quantité}
+        self._inventory: dict[int, dict] = {}
+        # [(id, user_id, argent, niveau, reason, ref, created_at)] dans l'ordre d'insertion
+        self._ledger_rows: list[tuple] = []
+        self._next_ledger_id = 1
+        self._snapshots: dict[int, tuple] = {}
+        self._pending_rewards: dict[int, list] = {}
+        self._reward_settlers: list = []
+
+    async def cog_load(self):
+        """Méthode appelée automatiquement lors du chargement du Cog."""
+        await self.create_db()
+        self.flush_rewards_periodically.start()
+        self.compact_ledger_periodically.start()
+
+    async def cog_unload(self):
+        self.flush_rewards_periodically.cancel()
+        self.compact_ledger_periodically.cancel()
+        self._settle_rewards()
+        await self.flush_rewards()
+
+    # Schéma
+    async def create_db(self):
+        """Ajoute les articles par défaut."""
+        existing = {(name, price) for name, price, _ in self._items.values()}
+        for item_name, item_price, item_desc in DEFAULT_ITEMS:
+            if (item_name, item_price) not in existing:
+                await self.add_item(item_name, item_price, item_desc)
+        print("🧠 Stockage en mémoire initialisé (aucune donnée n'est persistée).")
+
+    async def drop_db(self):
+        """Supprime tous les utilisateurs."""
+        self._users.clear()
+        print("✅ Table `users` droppée si existante avec succès.")
+
+    # Utilisateurs
+    def _user(self, user_id, username=None, argent=DEFAULT_ARGENT):
+        """Retourne la ligne d'un utilisateur, créée avec les valeurs par défaut si besoin.
+
+        Comme le trigger users_ledger_opening de SQLite, la création journalise le solde initial.
+        """
+        user = self._users.get(user_id)
+        if user is None:
+            user = self._users[user_id] = {
+                "username": username or f"User_{user_id}",
+                "argent": argent,
+                "niveau": 0,
+                "discriminator": None,
+                "joined_at": None,
+                "roles": None,
+            }
+            self._ledger([(user_id, argent, 0)], "ouverture")
+        return user
+
+    def _pending_for(self, user_id):
+        self._settle_rewards(user_id)
+        return tuple(self._pending_rewards.get(user_id, (0, 0)))
+
+    def user_cache_stats(self):
+        """Pas de cache : toutes les lectures sont déjà en mémoire."""
+        return {"size": len(self._users), "max_size": len(self._users), "hits": 0, "misses": 0,
+                "evictions": 0, "hit_rate": 0.0}
+
+    async def user_get_balance(self, user_id):
+        """Obtenir la balance (argent, en millièmes) d'un utilisateur, gains en attente compris."""
+        user = self._users.get(user_id)
+        pending_money, _ = self._pending_for(user_id)
+        if user:
+            return user["argent"] + pending_money
+        elif user_id in self._pending_rewards:
+            return DEFAULT_ARGENT + pending_money
+        print(f"⚠️ Erreur lors de la récupération du user id=`{user_id}`")
+        return None
+
+    async def user_add_balance(self, user_id, amount, reason="ajustement", ref=None):
+        """Ajouter de l'argent (`amount` en millièmes) à un utilisateur (créé s'il n'existe pas)."""
+        user = self._user(user_id)
+        user["argent"] += amount
+        self._ledger([(user_id, amount, 0)], reason, ref)
+        return user["argent"] + self._pending_for(user_id)[0]
+
+    def _spend(self, user_id, amount):
+        """Débite `amount` si le solde (gains en attente compris) suffit ; retourne (débité, solde)."""
+        user = self._user(user_id)
+        pending_money = self._pending_for(user_id)[0]
+        if user["argent"] + pending_money < amount:
+            return False, user["argent"] + pending_money
+        user["argent"] -= amount
+        return True, user["argent"] + pending_money
+
+    async def user_spend_balance(self, user_id, amount, reason="depense", ref=None):
+        """Débite `amount` (en millièmes) seulement si le solde suffit."""
+        spent, balance = self._spend(user_id, amount)
+        if spent:
+            self._ledger([(user_id, -amount, 0)], reason, ref)
+        return spent, balance
+
+    async def user_transfer_balance(self, from_id, to_id, amount,
+                                    sent_reason="don_envoye", received_reason="don_recu"):
+        """Transfère `amount` (en millièmes) si le solde de `from_id` suffit."""
+        spent, from_balance = self._spend(from_id, amount)
+        if not spent:
+            return False, from_balance, None
+        to_user = self._user(to_id)
+        to_user["argent"] += amount
+        self._ledger([(from_id, -amount, 0)], sent_reason, f"user:{to_id}")
+        self._ledger([(to_id, amount, 0)], received_reason, f"user:{from_id}")
+        return True, from_balance, to_user["argent"] + self._pending_for(to_id)[0]
+
+    async def user_reset_balance(self, user_id, reason="reset", ref=None):
+        """Reset l'argent d'un utilisateur (créé s'il n'existe pas)."""
+        if user_id in self._users:
+            self._ledger([(user_id, -self._users[user_id]["argent"], 0)], reason, ref)
+            self._users[user_id]["argent"] = 0
+        else:
+            self._user(user_id, argent=0)
+        self._settle_rewards(user_id)
+        if user_id in self._pending_rewards:
+            self._pending_rewards[user_id][0] = 0
+        return 0
+
+    async def user_get_niveau(self, user_id):
+        """Retourne le niveau (en millièmes) d'un utilisateur, gains en attente compris."""
+        user = self._users.get(user_id)
+        _, pending_xp = self._pending_for(user_id)
+        if user:
+            return user["niveau"] + pending_xp
+        elif user_id in self._pending_rewards:
+            return pending_xp
+        print(f"⚠️ Erreur lors de la récupération du user id=`{user_id}`")
+        return None
+
+    async def user_add_niveau(self, user_id, amount, reason="ajustement", ref=None):
+        """Ajoute des niveaux à un utilisateur (créé s'il n'existe pas)."""
+        user = self._user(user_id)
+        user["niveau"] += amount
+        self._ledger([(user_id, 0, amount)], reason, ref)
+        return user["niveau"] + self._pending_for(user_id)[1]
+
+    async def user_reset_niveau(self, user_id, reason="reset", ref=None):
+        """Reset le niveau d'un utilisateur (créé s'il n'existe pas)."""
+        if user_id in self._users:
+            self._ledger([(user_id, 0, -self._users[user_id]["niveau"])], reason, ref)
+        self._user(user_id)["niveau"] = 0
+        self._settle_rewards(user_id)
+        if user_id in self._pending_rewards:
+            self._pending_rewards[user_id][1] = 0
+        return 0
+
+    async def user_ensure_exist(self, member: discord.Member):
+        """Ajoute un utilisateur s'il n'existe pas."""
+        if member.id not in self._users:
+            user = self._user(member.id, member.name)
+            user["discriminator"] = member.discriminator
+            user["joined_at"] = str(member.joined_at)
+            user["roles"] = ", ".join([role.name for role in member.roles if role.name != "@everyone"])
+
+    async def user_create(self, user_id):
+        """Crée un utilisateur avec les valeurs par défaut."""
+        if user_id not in self._users:
+            self._user(user_id)
+            print(f"✅ Utilisateur {user_id} créé avec {format_milli(DEFAULT_ARGENT)} jetons.")
+
+    # Gains différés et mutations groupées
+    def user_queue_reward(self, user_id, money=0, xp=0):
+        """Accumule un gain (en millièmes) ; il sera appliqué au prochain flush."""
+        pending = self._pending_rewards.setdefault(user_id, [0, 0])
+        pending[0] += money
+        pending[1] += xp
+
+    def add_reward_settler(self, settler):
+        """Enregistre une source de gains accumulés hors base (voir StorageBackend)."""
+        self._reward_settlers.append(settler)
+
+    def remove_reward_settler(self, settler):
+        """Retire une source de gains enregistrée par add_reward_settler."""
+        if settler in self._reward_settlers:
+            self._reward_settlers.remove(settler)
+
+    def _settle_rewards(self, user_id=None):
+        """Fait verser aux sources leurs gains accumulés pour `user_id` (None : tous)."""
+        for settler in self._reward_settlers:
+            settler(user_id)
+
+    async def flush_rewards(self):
+        """Applique tous les gains en attente."""
+        pending, self._pending_rewards = self._pending_rewards, {}
+        self._add_deltas(pending, "recompense", None)
+
+    def _add_deltas(self, deltas, reason, ref):
+        """Applique {user_id: [argent, niveau]} (utilisateurs créés au besoin)."""
+        for user_id, (money, xp) in deltas.items():
+            user = self._user(user_id)
+            user["argent"] += money
+            user["niveau"] += xp
+        self._ledger([(user_id, money, xp) for user_id, (money, xp) in deltas.items()], reason, ref)
+
+    async def bulk_add_balance(self, deltas, reason="ajustement", ref=None):
+        """Ajoute de l'argent à plusieurs utilisateurs : liste de (user_id, montant en millièmes)."""
+        totals = {}
+        for user_id, amount in deltas:
+            totals.setdefault(user_id, [0, 0])[0] += amount
+        self._add_deltas(totals, reason, ref)
+        return True
+
+    async def bulk_add_niveau(self, deltas, reason="ajustement", ref=None):
+        """Ajoute des niveaux à plusieurs utilisateurs : liste de (user_id, montant en millièmes)."""
+        totals = {}
+        for user_id, amount in deltas:
+            totals.setdefault(user_id, [0, 0])[1] += amount
+        self._add_deltas(totals, reason, ref)
+        return True
+
+    async def bulk_ensure_users(self, user_ids):
+        """Crée les utilisateurs absents parmi `user_ids`."""
+        for user_id in user_ids:
+            self._user(user_id)
+        return True
+
+    @tasks.loop(seconds=REWARDS_FLUSH_INTERVAL)
+    async def flush_rewards_periodically(self):
+        await self.flush_rewards()
+
+    # Journal des transactions
+    def _ledger(self, entries, reason, ref=None):
+        """Ajoute au journal les entrées (user_id, delta_argent, delta_niveau) non nulles."""
+        created_at = _now()
+        for user_id, money, xp in entries:
+            if money or xp:
+                self._ledger_rows.append((self._next_ledger_id, user_id, money, xp, reason, ref, created_at))
+                self._next_ledger_id += 1
+
+    async def get_user_ledger(self, user_id, limit=20):
+        """Retourne les dernières entrées du journal d'un utilisateur (plus récentes d'abord)."""
+        entries = []
+        for _, entry_user, money, xp, reason, ref, created_at in reversed(self._ledger_rows):
+            if entry_user == user_id:
+                entries.append((money, xp, reason, ref, created_at))
+                if len(entries) == limit:
+                    break
+        return entries
+
+    async def compact_ledger(self, retention_days=LEDGER_RETENTION_DAYS):
+        """Replie les entrées plus anciennes que `retention_days` dans les instantanés."""
+        threshold = (datetime.now(timezone.utc) - timedelta(days=retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+        cutoff = max((row[0] for row in self._ledger_rows if row[6] < threshold), default=None)
+        if cutoff is None:
+            return 0
+        folded = [row for row in self._ledger_rows if row[0] <= cutoff]
+        kept = [row for row in self._ledger_rows if row[0] > cutoff]
+        recent = {}
+        for _, user_id, money, xp, *_ in kept:
+            totals = recent.setdefault(user_id, [0, 0])
+            totals[0] += money
+            totals[1] += xp
+        taken_at = _now()
+        for user_id in {row[1] for row in folded}:
+            user = self._users.get(user_id)
+            if user:
+                money, xp = recent.get(user_id, (0, 0))
+                self._snapshots[user_id] = (user["argent"] - money, user["niveau"] - xp, cutoff, taken_at)
+        self._ledger_rows = kept
+        print(f"🧾 Journal compacté : {len(folded)} entrée(s) repliée(s) dans les instantanés.")
+        return len(folded)
+
+    @tasks.loop(hours=LEDGER_COMPACTION_INTERVAL)
+    async def compact_ledger_periodically(self):
+        await self.compact_ledger()
+
+    # Boutique
+    async def get_all_items(self):
+        """Retourne tous les articles de la boutique."""
+        return [(item_id, *item) for item_id, item in self._items.items()]
+
+    async def get_item(self, item_id):
+        """Retourne les informations d'un article."""
+        return self._items.get(item_id)
+
+    async def get_items_page(self, sort="price", after=None, limit=20):
+        """Retourne une page du catalogue triée par `sort` ("price" ou "name") puis par id."""
+        if sort not in ITEM_SORTS:
+            raise ValueError(f"Tri inconnu : {sort}")
+        keys = self._item_keys.get(sort)
+        if keys is None:
+            column = 1 if sort == "price" else 0
+            keys = self._item_keys[sort] = sorted((item[column], item_id) for item_id, item in self._items.items())
+        start = bisect_right(keys, tuple(after)) if after else 0
+        return [(item_id, *self._items[item_id]) for _, item_id in keys[start:start + limit]]
+
+    async def search_items(self, text, limit=10):
+        """Recherche par préfixes dans le nom et la description (parcours complet du catalogue)."""
+        terms = search_words(text)
+        if not terms:
+            return []
+        results = []
+        for item_id, (name, price, description) in self._items.items():
+            name_words, desc_words = search_words(name), search_words(description)
+            score = 0
+            for term in terms:
+                name_hits = sum(word.startswith(term) for word in name_words)
+                desc_hits = sum(word.startswith(term) for word in desc_words)
+                if not name_hits and not desc_hits:
+                    break
+                # Même pondération que bm25(items_fts, 10.0, 1.0) côté SQLite
+                score += 10 * name_hits + desc_hits
+            else:
+                results.append((-score, item_id, (item_id, name, price, description)))
+        results.sort()
+        return [item for _, _, item in results[:limit]]
+
+    async def add_item(self, name, price, description=""):
+        """Ajoute un article à la boutique."""
+        self._items[self._next_item_id] = (name, price, description)
+        self._next_item_id += 1
+        self._item_keys.clear()
+        return True
+
+    async def remove_item(self, item_id):
+        """Supprime un article de la boutique."""
+        self._item_keys.clear()
+        self._item_stock.pop(item_id, None)
+        return self._items.pop(item_id, None) is not None
+
+    async def set_item_stock(self, item_id, stock=None, per_user_limit=None):
+        """Fixe le stock et la limite d'achat par utilisateur d'un article (None = illimité)."""
+        if item_id not in self._items:
+            return False
+        self._item_stock[item_id] = [stock, per_user_limit]
+        return True
+
+    async def get_item_stock(self, item_id):
+        """Retourne (stock, per_user_limit) d'un article."""
+        if item_id not in self._items:
+            return None
+        return tuple(self._item_stock.get(item_id, (None, None)))
+
+    async def purchase(self, user_id, item_id):
+        """Achat atomique d'un article (voir StorageBackend.purchase)."""
+        item = self._items.get(item_id)
+        if item is None:
+            return PURCHASE_NO_ITEM, None, None
+        price = to_milli(item[1])
+        pending_money = self._pending_for(user_id)[0]
+        user = self._user(user_id)
+        limits = self._item_stock.get(item_id)
+        if limits is not None:
+            stock, per_user_limit = limits
+            if stock is not None and stock <= 0:
+                return PURCHASE_SOLD_OUT, user["argent"] + pending_money, item
+            if per_user_limit is not None and self._inventory.get(user_id, {}).get(item_id, 0) >= per_user_limit:
+                return PURCHASE_LIMIT_REACHED, user["argent"] + pending_money, item
+        if user["argent"] + pending_money < price:
+            return PURCHASE_NO_FUNDS, user["argent"] + pending_money, item
+        if limits is not None and limits[0] is not None:
+            limits[0] -= 1
+        user["argent"] -= price
+        self._ledger([(user_id, -price, 0)], "achat", f"item:{item_id}")
+        self._record_purchase(user_id, item_id)
+        return PURCHASE_OK, user["argent"] + pending_money, item
+
+    def _record_purchase(self, user_id, item_id):
+        """Enregistre l'achat et incrémente l'inventaire."""
+        self._purchases.setdefault(user_id, []).append((self._next_purchase_id, item_id, _now()))
+        self._next_purchase_id += 1
+        owned = self._inventory.setdefault(user_id, {})
+        owned[item_id] = owned.get(item_id, 0) + 1
+
+    # Inventaire
+    async def get_inventory(self, user_id):
+        """Retourne l'inventaire (item_id, nom, quantité) d'un utilisateur."""
+        inventory = [(item_id, self._items[item_id][0], quantity)
+                     for item_id, quantity in self._inventory.get(user_id, {}).items()
+                     if quantity > 0 and item_id in self._items]
+        return sorted(inventory, key=lambda row: row[1])
+
+    async def user_owns_item(self, user_id, item_id):
+        """Indique si l'utilisateur possède l'article."""
+        return self._inventory.get(user_id, {}).get(item_id, 0) > 0
+
+    async def get_item_id(self, name):
+        """Retourne l'id du premier article portant ce nom."""
+        return min((item_id for item_id, item in self._items.items() if item[0] == name), default=None)
+
+    async def get_user_purchases(self, user_id, before=None, limit=PURCHASES_PAGE_SIZE):
+        """Retourne une page de l'historique des achats d'un utilisateur, plus récents d'abord."""
+        page = []
+        # Les achats d'un utilisateur sont déjà triés par (timestamp, id) : parcours à rebours
+        for purchase_id, item_id, timestamp in reversed(self._purchases.get(user_id, [])):
+            if before and (timestamp, purchase_id) >= tuple(before):
+                continue
+            # Comme la jointure SQL : les achats d'articles supprimés n'apparaissent pas
+            if item_id in self._items:
+                page.append((purchase_id, self._items[item_id][0], timestamp))
+                if len(page) == limit:
+                    break
+        return page
+
+
+async def setup(bot):
+    """Ajoute le Cog au bot."""
+    await bot.add_cog(MemoryDBManager(bot))
@@ -0,0 +1,210 @@
+"""Instrumentation des appels au stockage.
+
+Chaque méthode publique d'un backend (voir storage.StorageBackend) est chronométrée :
+nombre d'appels, nombre d'erreurs et histogramme des latences par nom de requête.
+Les appels sont aussi comptés par « portée » (une commande ou un callback de vue)
+pour repérer les schémas N+1.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import time
+from contextlib import contextmanager
+from storage import StorageBackend
+
+DB_METRICS_PATH = "db_metrics.json"  # Fichier de dump des métriques
+# Bornes supérieures des seaux de l'histogramme, en millisecondes
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 1000, float("inf"))
+
+# Portée courante (commande, callback de vue) : compteur d'appels au stockage
+_scope = contextvars.ContextVar("db_scope", default=None)
+# Appel instrumenté en cours : passe à True si db_error() est appelé pendant l'appel
+_call_failed = contextvars.ContextVar("db_call_failed", default=None)
+
+
+class QueryStats:
+    """Compteurs et histogramme des latences d'une requête."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+
+    def record(self, elapsed_ms, failed):
+        self.count += 1
+        self.errors += failed
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[index] += 1
+                break
+
+    def percentile(self, fraction):
+        """Borne supérieure du seau contenant le percentile demandé."""
+        target = fraction * self.count
+        seen = 0
+        for bound, hits in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += hits
+            if hits and seen >= target:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": self.total_ms / self.count if self.count else 0.0,
+            "p95_ms": self.percentile(0.95),
+            "max_ms": self.max_ms,
+            "histogram_ms": {("inf" if bound == float("inf") else str(bound)): hits
+                             for bound, hits in zip(LATENCY_BUCKETS_MS, self.buckets)},
+        }
+
+
+class ScopeStats:
+    """Nombre d'appels au stockage par exécution d'une commande ou d'un callback."""
+
+    def __init__(self):
+        self.runs = 0
+        self.calls = 0
+        self.max_calls = 0
+
+    def record(self, calls):
+        self.runs += 1
+        self.calls += calls
+        self.max_calls = max(self.max_calls, calls)
+
+    def to_dict(self):
+        return {
+            "runs": self.runs,
+            "calls": self.calls,
+            "avg_calls": self.calls / self.runs if self.runs else 0.0,
+            "max_calls": self.max_calls,
+        }
+
+
+class DBMetrics:
+    """Registre des métriques du stockage, partagé par tous les backends."""
+
+    def __init__(self):
+        self.queries: dict[str, QueryStats] = {}
+        self.scopes: dict[str, ScopeStats] = {}
+        self.started_at = time.time()
+
+    def record(self, name, elapsed_ms, failed):
+        self.queries.setdefault(name, QueryStats()).record(elapsed_ms, failed)
+        scope = _scope.get()
+        if scope is not None:
+            scope[1] += 1
+
+    def begin_scope(self, name):
+        """Ouvre une portée : les appels suivants de la tâche courante lui sont attribués."""
+        _scope.set([name, 0])
+
+    def end_scope(self):
+        """Ferme la portée courante et enregistre son nombre d'appels."""
+        scope = _scope.get()
+        if scope is not None:
+            name, calls = scope
+            self.scopes.setdefault(name, ScopeStats()).record(calls)
+            _scope.set(None)
+
+    @contextmanager
+    def scope(self, name):
+        """Portée le temps d'un bloc, pour les callbacks de vues (hors commandes)."""
+        token = _scope.set([name, 0])
+        try:
+            yield
+        finally:
+            name, calls = _scope.get()
+            self.scopes.setdefault(name, ScopeStats()).record(calls)
+            _scope.reset(token)
+
+    def scoped(self, name=None):
+        """Décorateur : une portée par appel du callback décoré (nom qualifié par défaut)."""
+        def decorator(func):
+            scope_name = name or func.__qualname__
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.scope(scope_name):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        self.queries.clear()
+        self.scopes.clear()
+        self.started_at = time.time()
+
+    def snapshot(self):
+        return {
+            "since": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+            "queries": {name: stats.to_dict() for name, stats in sorted(self.queries.items())},
+            "scopes": {name: stats.to_dict() for name, stats in sorted(self.scopes.items())},
+        }
+
+    def dump(self, path=DB_METRICS_PATH):
+        """Écrit les métriques au format JSON ; retourne le chemin du fichier."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2, ensure_ascii=False)
+        return path
+
+
+metrics = DBMetrics()
+
+
+def db_error(message):
+    """Affiche une erreur du stockage et la compte pour l'appel instrumenté en cours."""
+    failed = _call_failed.get()
+    if failed is not None:
+        failed[0] = True
+    print(message)
+
+
+def _timed(name, method):
+    """Enveloppe une méthode (coroutine ou non) pour la chronométrer."""
+    if asyncio.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            failed = [False]
+            token = _call_failed.set(failed)
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            except Exception:
+                failed[0] = True
+                raise
+            finally:
+                _call_failed.reset(token)
+                metrics.record(name, (time.perf_counter() - start) * 1000, failed[0])
+    else:
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            failed = [False]
+            token = _call_failed.set(failed)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except Exception:
+                failed[0] = True
+                raise
+            finally:
+                _call_failed.reset(token)
+                metrics.record(name, (time.perf_counter() - start) * 1000, failed[0])
+    return wrapper
+
+
+def instrumented(cls):
+    """Décorateur de classe : chronomètre toutes les méthodes de StorageBackend définies par `cls`."""
+    for name, attr in vars(StorageBackend).items():
+        if name.startswith("_") or not callable(attr):
+            continue
+        method = cls.__dict__.get(name)
+        if method is not None:
+            setattr(cls, name, _timed(name, method))
+    return cls
@@ -0,0 +1,265 @@
+"""Migrations versionnées du schéma de la base.
+
+Chaque migration est une coroutine `migrate(conn)` exécutée par l'écrivain de
+DBManager dans une transaction ; la liste MIGRATIONS est ordonnée et ne doit
+jamais être réécrite : on ajoute une nouvelle version à la fin.
+"""
+
+DEFAULT_ITEMS = [
+    ("Roulette russe", 200, "Un jeu dangereux qui peut vous faire gagner ou perdre gros !"),
+    ("VIP", 500000, "Accès VIP au serveur avec des privilèges exclusifs")
+]
+
+
+async def _columns(conn, table):
+    """Retourne les noms des colonnes d'une table."""
+    async with conn.execute(f"PRAGMA table_info({table})") as cursor:
+        return {row[1] for row in await cursor.fetchall()}
+
+
+async def migration_1_initial(conn):
+    """Schéma initial : users, items, purchases et articles par défaut.
+
+    Idempotente pour les bases créées avant l'introduction des migrations.
+    """
+    await conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT NOT NULL,
+        argent INTEGER DEFAULT 500,
+        niveau INTEGER DEFAULT 0,
+        discriminator TEXT,
+        joined_at TEXT,
+        roles TEXT
+    )
+    ''')
+
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            description TEXT DEFAULT ''
+        )
+    ''')
+
+    # Anciennes bases : la colonne description a été ajoutée après coup
+    if "description" not in await _columns(conn, "items"):
+        await conn.execute("ALTER TABLE items ADD COLUMN description TEXT DEFAULT ''")
+        print("✅ Colonne description ajoutée à la table items.")
+
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS purchases (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            item_id INTEGER,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Nettoyer les doublons laissés par les anciens démarrages
+    await conn.execute("""
+        DELETE FROM items WHERE id NOT IN (
+            SELECT MIN(id) FROM items GROUP BY name, price
+        )
+    """)
+
+    for item_name, item_price, item_desc in DEFAULT_ITEMS:
+        async with conn.execute("SELECT COUNT(*) FROM items WHERE name = ? AND price = ?", (item_name, item_price)) as cursor:
+            if (await cursor.fetchone())[0] == 0:
+                await conn.execute("INSERT INTO items (name, price, description) VALUES (?, ?, ?)", (item_name, item_price, item_desc))
+
+
+async def migration_2_ledger(conn):
+    """Journal des transactions (append-only) et instantanés de soldes."""
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            argent INTEGER NOT NULL DEFAULT 0,
+            niveau INTEGER NOT NULL DEFAULT 0,
+            reason TEXT NOT NULL,
+            ref TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger (user_id, id)")
+
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS ledger_snapshots (
+            user_id INTEGER PRIMARY KEY,
+            argent INTEGER NOT NULL,
+            niveau INTEGER NOT NULL,
+            last_ledger_id INTEGER NOT NULL,
+            taken_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Point de départ de l'historique : les soldes existants avant le journal
+    await conn.execute("""
+        INSERT OR IGNORE INTO ledger_snapshots (user_id, argent, niveau, last_ledger_id)
+        SELECT user_id, argent, niveau, 0 FROM users
+    """)
+
+
+async def migration_3_purchases_index(conn):
+    """Index couvrant pour l'historique d'achats paginé par (timestamp, id)."""
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_purchases_user_time
+        ON purchases (user_id, timestamp, id, item_id)
+    """)
+
+
+async def migration_4_fixed_point(conn):
+    """Argent et niveau en millièmes entiers (voir fixed_point.py).
+
+    La table users est reconstruite pour que les valeurs par défaut soient
+    elles aussi en millièmes ; les anciens REAL sont arrondis au millième.
+    """
+    await conn.execute('''
+    CREATE TABLE users_milli (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT NOT NULL,
+        argent INTEGER NOT NULL DEFAULT 500000,
+        niveau INTEGER NOT NULL DEFAULT 0,
+        discriminator TEXT,
+        joined_at TEXT,
+        roles TEXT
+    )
+    ''')
+    await conn.execute("""
+        INSERT INTO users_milli (user_id, username, argent, niveau, discriminator, joined_at, roles)
+        SELECT user_id, username,
+               CAST(ROUND(COALESCE(argent, 0) * 1000) AS INTEGER),
+               CAST(ROUND(COALESCE(niveau, 0) * 1000) AS INTEGER),
+               discriminator, joined_at, roles
+        FROM users
+    """)
+    await conn.execute("DROP TABLE users")
+    await conn.execute("ALTER TABLE users_milli RENAME TO users")
+
+    for table in ("ledger", "ledger_snapshots"):
+        await conn.execute(f"""
+            UPDATE {table}
+            SET argent = CAST(ROUND(argent * 1000) AS INTEGER),
+                niveau = CAST(ROUND(niveau * 1000) AS INTEGER)
+        """)
+
+
+async def migration_5_items_sort_indexes(conn):
+    """Index de pagination par clé du catalogue (tri par prix ou par nom)."""
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_items_price ON items (price, id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_items_name ON items (name, id)")
+
+
+async def migration_6_items_fts(conn):
+    """Index plein texte FTS5 sur le nom et la description des articles, synchronisé par triggers."""
+    await conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+            name, description,
+            content='items', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    await conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN
+            INSERT INTO items_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    """)
+    await conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN
+            INSERT INTO items_fts (items_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        END
+    """)
+    await conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE ON items BEGIN
+            INSERT INTO items_fts (items_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO items_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    """)
+    # Indexer les articles existants
+    await conn.execute("INSERT INTO items_fts (items_fts) VALUES ('rebuild')")
+
+
+async def migration_7_inventory(conn):
+    """Inventaire agrégé (quantité par utilisateur et article), initialisé depuis purchases."""
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS inventory (
+            user_id INTEGER NOT NULL,
+            item_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, item_id)
+        ) WITHOUT ROWID
+    ''')
+    await conn.execute("""
+        INSERT OR IGNORE INTO inventory (user_id, item_id, quantity)
+        SELECT user_id, item_id, COUNT(*)
+        FROM purchases
+        WHERE user_id IS NOT NULL AND item_id IS NOT NULL
+        GROUP BY user_id, item_id
+    """)
+
+
+async def migration_8_item_stock(conn):
+    """Stock et limite d'achat par utilisateur des articles (NULL = illimité).
+
+    Le trigger de mise à jour de items_fts est restreint au nom et à la description :
+    chaque achat décrémente le stock et ne doit pas réindexer l'article.
+    """
+    columns = await _columns(conn, "items")
+    if "stock" not in columns:
+        await conn.execute("ALTER TABLE items ADD COLUMN stock INTEGER CHECK (stock >= 0)")
+    if "per_user_limit" not in columns:
+        await conn.execute("ALTER TABLE items ADD COLUMN per_user_limit INTEGER CHECK (per_user_limit > 0)")
+
+    await conn.execute("DROP TRIGGER IF EXISTS items_fts_update")
+    await conn.execute("""
+        CREATE TRIGGER items_fts_update AFTER UPDATE OF name, description ON items BEGIN
+            INSERT INTO items_fts (items_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO items_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    """)
+
+
+async def migration_9_ledger_opening(conn):
+    """Journalise la création des comptes : solde initial en entrée « ouverture ».
+
+    Le trigger couvre toute insertion dans users (valeurs par défaut ou non). Les comptes
+    créés depuis la migration 2 sans entrée d'ouverture reçoivent l'écart entre leur
+    solde et instantané + journal, pour que le rejeu retombe sur users.
+    """
+    await conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_ledger_opening AFTER INSERT ON users
+        WHEN new.argent != 0 OR new.niveau != 0 BEGIN
+            INSERT INTO ledger (user_id, argent, niveau, reason) VALUES (new.user_id, new.argent, new.niveau, 'ouverture');
+        END
+    """)
+    await conn.execute("""
+        INSERT INTO ledger (user_id, argent, niveau, reason)
+        SELECT user_id, argent, niveau, 'ouverture' FROM (
+            SELECT users.user_id,
+                   users.argent - COALESCE(snap.argent, 0) - COALESCE(SUM(ledger.argent), 0) AS argent,
+                   users.niveau - COALESCE(snap.niveau, 0) - COALESCE(SUM(ledger.niveau), 0) AS niveau
+            FROM users
+            LEFT JOIN ledger_snapshots AS snap ON snap.user_id = users.user_id
+            LEFT JOIN ledger ON ledger.user_id = users.user_id AND ledger.id > COALESCE(snap.last_ledger_id, 0)
+            GROUP BY users.user_id
+        )
+        WHERE argent != 0 OR niveau != 0
+    """)
+
+
+# (version, description, migration) — ordre croissant
+MIGRATIONS = [
+    (1, "schéma initial", migration_1_initial),
+    (2, "journal des transactions", migration_2_ledger),
+    (3, "index de l'historique d'achats", migration_3_purchases_index),
+    (4, "montants en millièmes", migration_4_fixed_point),
+    (5, "index de tri du catalogue", migration_5_items_sort_indexes),
+    (6, "recherche plein texte des articles", migration_6_items_fts),
+    (7, "inventaire", migration_7_inventory),
+    (8, "stock et limite par utilisateur", migration_8_item_stock),
+    (9, "ouverture des comptes au journal", migration_9_ledger_opening),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
@@ -1,22 +1,207 @@
+import asyncio
+import time
+import unicodedata
+from collections import OrderedDict, deque
 import discord
-from discord.ext import commands, tasks
-from db_manager import DBManager
+from discord.ext import commands
+from storage import StorageBackend
+from fixed_point import format_milli, to_milli
 
-# Constantes
-MONEY_INTERVAL = 10  # secondes
-LEVEL_INTERVAL = 10
-MESSAGE_MONEY = 0.2
-MESSAGE_LEVEL = 0.01
+# Constantes (gains en millièmes, voir fixed_point.py)
+MONEY_INTERVAL = 10  # secondes : VOICE_MONEY gagné par MONEY_INTERVAL passé en vocal
+LEVEL_INTERVAL = 10  # secondes : VOICE_LEVEL gagné par LEVEL_INTERVAL passé en vocal
+ECONOMY_TICK_INTERVAL = 300  # secondes entre deux ticks de l'ordonnanceur (versement des sessions vocales)
+ECONOMY_LAG_WARNING = 5  # secondes de retard d'un tick au-delà desquelles on le signale
+VOICE_MONEY = to_milli(3)
+VOICE_LEVEL = to_milli("0.1")
+MESSAGE_MONEY = to_milli("0.2")
+MESSAGE_LEVEL = to_milli("0.01")
+# Messages récompensés par utilisateur : rafale de MESSAGE_REWARD_BURST, puis un toutes les
+# MESSAGE_REWARD_REFILL secondes (seau à jetons)
+MESSAGE_REWARD_BURST = 3
+MESSAGE_REWARD_REFILL = 20
+MESSAGE_BUCKETS_MAX = 10000  # nombre max de seaux gardés en mémoire
+# Anti-copier-coller : un message identique (à la casse, aux accents, aux espaces et à la
+# ponctuation près) à l'un des MESSAGE_DUPLICATE_WINDOW derniers du salon ne rapporte rien
+MESSAGE_DUPLICATE_WINDOW = 20
+MESSAGE_CHANNELS_MAX = 1000  # nombre max de salons suivis
 
 ROLE_ID = 1279001249022476342  # Role vocal
 ROLE_ID2 = 1271165198392365207  # Role global
 
+
+class VoiceSession:
+    """Session vocale rémunérée d'un membre : gains calculés à partir de la durée."""
+
+    def __init__(self, member, started_at):
+        self.member = member
+        self.started_at = started_at
+        # Déjà versé depuis le début de la session (millièmes)
+        self.paid_money = 0
+        self.paid_xp = 0
+
+    def accrue(self, now):
+        """Retourne les gains (argent, niveau) acquis depuis le dernier versement et les marque versés.
+
+        Les gains sont recalculés depuis le début de la session : les arrondis ne
+        s'accumulent pas d'un versement à l'autre.
+        """
+        elapsed = max(0.0, now - self.started_at)
+        money = int(elapsed * VOICE_MONEY / MONEY_INTERVAL) - self.paid_money
+        xp = int(elapsed * VOICE_LEVEL / LEVEL_INTERVAL) - self.paid_xp
+        self.paid_money += money
+        self.paid_xp += xp
+        return money, xp
+
+
+class TokenBucketLimiter:
+    """Seau à jetons par clé, en mémoire bornée.
+
+    Un seau resté inactif assez longtemps pour être de nouveau plein équivaut à un
+    seau neuf : il est évincé. Au-delà de `max_buckets`, le moins récemment utilisé
+    est évincé.
+    """
+
+    def __init__(self, capacity, refill_seconds, max_buckets):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.max_buckets = max_buckets
+        self.idle_after = capacity * refill_seconds
+        # clé -> [jetons, dernière mise à jour], du moins au plus récemment utilisé
+        self._buckets: OrderedDict = OrderedDict()
+        self.allowed = 0
+        self.denied = 0
+
+    def allow(self, key, now=None):
+        """Consomme un jeton du seau de `key` ; retourne False si le seau est vide."""
+        now = time.monotonic() if now is None else now
+        self._evict_idle(now)
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            tokens = self.capacity
+        else:
+            tokens = min(self.capacity, bucket[0] + (now - bucket[1]) / self.refill_seconds)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+            self.allowed += 1
+        else:
+            self.denied += 1
+        self._buckets[key] = [tokens, now]
+        if len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+        return allowed
+
+    def _evict_idle(self, now):
+        """Évince les seaux inactifs, en tête de l'ordre d'utilisation : O(1) amorti."""
+        while self._buckets:
+            _, (_, last) = next(iter(self._buckets.items()))
+            if now - last < self.idle_after:
+                break
+            self._buckets.popitem(last=False)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class DuplicateFilter:
+    """Fenêtre glissante des empreintes des derniers messages, par salon.
+
+    Chaque salon garde un anneau de taille fixe d'empreintes et leur nombre
+    d'occurrences : test et mise à jour en O(1) par message.
+    """
+
+    def __init__(self, window, max_channels):
+        self.window = window
+        self.max_channels = max_channels
+        # channel_id -> (anneau des empreintes, {empreinte: occurrences}), du moins au plus récent
+        self._channels: OrderedDict = OrderedDict()
+        self.duplicates = 0
+
+    @staticmethod
+    def fingerprint(content):
+        """Empreinte du contenu normalisé ; None pour un message sans texte."""
+        decomposed = unicodedata.normalize("NFKD", content.casefold())
+        normalized = "".join(char for char in decomposed if char.isalnum())
+        # Message fait uniquement d'emojis ou de ponctuation : empreinte du texte brut
+        normalized = normalized or content.strip()
+        return hash(normalized) if normalized else None
+
+    def seen(self, channel_id, content):
+        """Enregistre le message ; True s'il répète l'un des derniers messages du salon."""
+        fingerprint = self.fingerprint(content)
+        if fingerprint is None:
+            return False
+        entry = self._channels.get(channel_id)
+        if entry is None:
+            entry = self._channels[channel_id] = (deque(), {})
+            if len(self._channels) > self.max_channels:
+                self._channels.popitem(last=False)
+        else:
+            self._channels.move_to_end(channel_id)
+        ring, counts = entry
+        duplicate = fingerprint in counts
+        if len(ring) == self.window:
+            oldest = ring.popleft()
+            if counts[oldest] == 1:
+                del counts[oldest]
+            else:
+                counts[oldest] -= 1
+        ring.append(fingerprint)
+        counts[fingerprint] = counts.get(fingerprint, 0) + 1
+        self.duplicates += duplicate
+        return duplicate
+
+
+class TickStats:
+    """Retard et durée des ticks de l'ordonnanceur économique."""
+
+    def __init__(self):
+        self.ticks = 0
+        self.skipped = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+
+    def record(self, lag, duration, skipped):
+        self.ticks += 1
+        self.skipped += skipped
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        self.total_duration += duration
+
+    def to_dict(self):
+        return {
+            "ticks": self.ticks,
+            "skipped": self.skipped,
+            "last_lag_s": self.last_lag,
+            "max_lag_s": self.max_lag,
+            "last_ms": self.last_duration * 1000,
+            "avg_ms": self.total_duration * 1000 / self.ticks if self.ticks else 0.0,
+            "max_ms": self.max_duration * 1000,
+        }
+
+
 class EconomyManager(commands.Cog):
     """Cog pour les gains automatiques d'argent et d'expérience."""
 
     def __init__(self, bot):
         self.bot = bot
-        self._db: DBManager | None = None
+        self._db: StorageBackend | None = None
+        # Sessions des membres qui gagnent en vocal : (guild_id, member_id) -> VoiceSession.
+        # Tenues à jour par les événements vocaux et de rôles ; les gains sont versés à la fin
+        # de la session, à la lecture du solde (add_reward_settler) ou par l'ordonnanceur.
+        self._voice_earners: dict[tuple[int, int], VoiceSession] = {}
+        self._scheduler_task: asyncio.Task | None = None
+        self.tick_stats = TickStats()
+        # Limite des gains par message, par utilisateur
+        self._message_limiter = TokenBucketLimiter(MESSAGE_REWARD_BURST, MESSAGE_REWARD_REFILL, MESSAGE_BUCKETS_MAX)
+        # Messages répétés (copier-coller) par salon
+        self._duplicate_filter = DuplicateFilter(MESSAGE_DUPLICATE_WINDOW, MESSAGE_CHANNELS_MAX)
 
     async def cog_load(self):
         """Chargement du cog."""
@@ -24,36 +209,142 @@ class EconomyManager(commands.Cog):
         if not self._db:
             raise RuntimeError("❌ DBManager doit être chargé avant EconomyManager")
 
-        self.give_money_periodically.start()
-        self.give_level_periodically.start()
+        for guild in self.bot.guilds:
+            self._index_guild(guild)
+        self._db.add_reward_settler(self.settle_voice)
+        self._scheduler_task = asyncio.create_task(self._run_scheduler())
+
+    async def cog_unload(self):
+        """Arrête l'ordonnanceur et verse les sessions en cours."""
+        if self._scheduler_task is not None:
+            self._scheduler_task.cancel()
+            self._scheduler_task = None
+        if self._db:
+            self.settle_voice()
+            self._db.remove_reward_settler(self.settle_voice)
 
     def is_in_vocal_with_role(self, member: discord.Member) -> bool:
         """Vérifie si le membre est en vocal ET possède le rôle requis."""
-        return member.voice and any(role.id == ROLE_ID for role in member.roles)
+        return bool(member.voice) and any(role.id == ROLE_ID for role in member.roles)
 
-    @tasks.loop(seconds=MONEY_INTERVAL)
-    async def give_money_periodically(self):
-        for guild in self.bot.guilds:
-            for member in guild.members:
-                if member.bot:
-                    continue
-                if self.is_in_vocal_with_role(member) and self._db:
-                    if self._db.user_get_niveau(member.id) is None:
-                        self._db.user_create(member.id)
-                    self._db.user_add_balance(member.id, 3)
-                    print(f"💰 {member.display_name} a reçu 3 jetons (vocal).")
-
-    @tasks.loop(seconds=LEVEL_INTERVAL)
-    async def give_level_periodically(self):
+    # Sessions vocales
+    def _settle_session(self, session: VoiceSession, now):
+        """Met en attente d'écriture les gains acquis par une session."""
+        money, xp = session.accrue(now)
+        if (money or xp) and self._db:
+            self._db.user_queue_reward(session.member.id, money=money, xp=xp)
+            print(f"🎙️ {session.member.display_name} a reçu {format_milli(money)} jetons "
+                  f"et {format_milli(xp)} XP (vocal).")
+
+    def _end_session(self, key):
+        """Termine la session d'un membre après avoir versé ses gains."""
+        session = self._voice_earners.pop(key, None)
+        if session is not None:
+            self._settle_session(session, time.monotonic())
+
+    def settle_voice(self, user_id=None):
+        """Verse les gains vocaux acquis par `user_id` (None : tous les membres en vocal)."""
+        now = time.monotonic()
+        if user_id is None:
+            sessions = list(self._voice_earners.values())
+        else:
+            sessions = [session for session in (self._voice_earners.get((guild.id, user_id))
+                                                for guild in self.bot.guilds) if session]
+        for session in sessions:
+            self._settle_session(session, now)
+
+    def _refresh_voice_earner(self, member: discord.Member):
+        """Ouvre ou termine la session du membre selon son état vocal et ses rôles."""
+        key = (member.guild.id, member.id)
+        if not member.bot and self.is_in_vocal_with_role(member):
+            session = self._voice_earners.get(key)
+            if session is None:
+                self._voice_earners[key] = VoiceSession(member, time.monotonic())
+            else:
+                session.member = member
+        else:
+            self._end_session(key)
+
+    def _index_guild(self, guild: discord.Guild):
+        """Resynchronise les sessions d'un serveur à partir des salons vocaux, pas de la liste des membres."""
+        in_voice = set()
+        for channel in (*guild.voice_channels, *guild.stage_channels):
+            for member in channel.members:
+                in_voice.add(member.id)
+                self._refresh_voice_earner(member)
+        for key in [key for key in self._voice_earners if key[0] == guild.id and key[1] not in in_voice]:
+            self._end_session(key)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # Cache des serveurs (re)chargé : les sessions repartent de l'état vocal réel
         for guild in self.bot.guilds:
-            for member in guild.members:
-                if member.bot:
-                    continue
-                if self.is_in_vocal_with_role(member) and self._db:
-                    if self._db.user_get_niveau(member.id) is None:
-                        self._db.user_create(member.id)
-                    self._db.user_add_niveau(member.id, 0.1)
-                    print(f"📈 {member.display_name} a reçu 0.1 XP (vocal).")
+            self._index_guild(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild):
+        self._index_guild(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        for key in [key for key in self._voice_earners if key[0] == guild.id]:
+            self._end_session(key)
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
+        self._refresh_voice_earner(member)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if before.roles != after.roles:
+            self._refresh_voice_earner(after)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        self._end_session((member.guild.id, member.id))
+
+    # Ordonnanceur économique
+    async def _run_scheduler(self, interval=ECONOMY_TICK_INTERVAL):
+        """Boucle unique des tâches économiques, sans dérive.
+
+        Le tick n est prévu à origine + n * interval (horloge monotone) : la durée d'un
+        tick ne décale pas les suivants. Un tick en retard de plus d'un intervalle
+        saute les ticks manqués au lieu de les enchaîner ; les gains vocaux étant
+        calculés à partir de la durée, le tick suivant les couvre entièrement.
+        """
+        origin = time.monotonic()
+        tick = 0
+        while True:
+            tick += 1
+            deadline = origin + tick * interval
+            await asyncio.sleep(max(0.0, deadline - time.monotonic()))
+            now = time.monotonic()
+            lag = now - deadline
+            skipped = int(lag // interval)
+            tick += skipped
+            try:
+                self._economy_tick()
+            except Exception as e:
+                print(f"⚠️ Erreur pendant le tick économique : {e}")
+            duration = time.monotonic() - now
+            self.tick_stats.record(lag, duration, skipped)
+            if lag > ECONOMY_LAG_WARNING or skipped:
+                print(f"⏱️ Tick économique en retard de {lag:.1f} s ({skipped} tick(s) sauté(s)), "
+                      f"durée {duration * 1000:.1f} ms.")
+
+    def _economy_tick(self):
+        """Un passage : argent et XP de toutes les sessions vocales, mis en attente d'écriture."""
+        # Versement de fond des longues sessions, pour limiter la perte en cas d'arrêt brutal
+        self.settle_voice()
+
+    def scheduler_stats(self):
+        """Compteurs de l'ordonnanceur (ticks, sautés, retards en s, durées en ms) et sessions en cours."""
+        return {**self.tick_stats.to_dict(), "interval_s": ECONOMY_TICK_INTERVAL,
+                "voice_sessions": len(self._voice_earners),
+                "message_buckets": len(self._message_limiter),
+                "messages_rewarded": self._message_limiter.allowed,
+                "messages_limited": self._message_limiter.denied,
+                "messages_duplicate": self._duplicate_filter.duplicates}
 
     @commands.Cog.listener()
     async def on_message(self, message):
@@ -63,13 +354,18 @@ class EconomyManager(commands.Cog):
         # Ne pas donner d'argent/XP pour les commandes du bot
         if message.content.startswith('$'):
             return
+
+        # Copier-coller : un message répété ne rapporte rien (il ne consomme pas de jeton)
+        if self._duplicate_filter.seen(message.channel.id, message.content):
+            return
+
+        # Rafales de messages : au-delà du seau de l'utilisateur, pas de gain ni d'écriture
+        if not self._message_limiter.allow(message.author.id):
+            return
             
-        user_id = message.author.id
-        if self._db.user_get_niveau(user_id) is None:
-            self._db.user_create(user_id)
-        self._db.user_add_balance(user_id, MESSAGE_MONEY)
-        self._db.user_add_niveau(user_id, MESSAGE_LEVEL)
-        print(f"✉️ {message.author.name} a gagné {MESSAGE_MONEY} jetons et {MESSAGE_LEVEL} XP via message.")
+        # Gain accumulé en mémoire, écrit en lot par DBManager
+        self._db.user_queue_reward(message.author.id, money=MESSAGE_MONEY, xp=MESSAGE_LEVEL)
+        print(f"✉️ {message.author.name} a gagné {format_milli(MESSAGE_MONEY)} jetons et {format_milli(MESSAGE_LEVEL)} XP via message.")
 
 async def setup(bot):
     await bot.add_cog(EconomyManager(bot))
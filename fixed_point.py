@@ -0,0 +1,23 @@
+"""Montants en virgule fixe.
+
+Les jetons et l'expérience sont stockés en base comme des entiers en millièmes
+(1 jeton = 1000 milli-jetons) : les additions et les agrégats restent exacts,
+sans les REAL que SQLite stockait pour 0.2 jeton ou 0.01 XP.
+"""
+from decimal import Decimal, ROUND_HALF_EVEN
+
+SCALE = 1000  # millièmes par unité
+
+
+def to_milli(value):
+    """Convertit un montant en unités (int, float ou str) en entier de millièmes."""
+    return int((Decimal(str(value)) * SCALE).to_integral_value(ROUND_HALF_EVEN))
+
+
+def format_milli(value):
+    """Formate des millièmes pour l'affichage : 502200 -> "502.2", 500000 -> "500"."""
+    sign = "-" if value < 0 else ""
+    whole, frac = divmod(abs(value), SCALE)
+    if not frac:
+        return f"{sign}{whole}"
+    return f"{sign}{whole}.{frac:03d}".rstrip("0")
@@ -11,6 +11,8 @@ import json
 import random
 from poker_game import PokerGame
 from economy_manager import EconomyManager
+from storage import DB_BACKENDS, DEFAULT_DB_BACKEND
+from db_metrics import metrics
 
 # Récuperation du token du bot depuis les variables d'environement
 TOKEN_BOT = os.environ['TOKEN_BOT']
@@ -59,9 +61,22 @@ async def on_command_error(ctx, error):
         print(error_traceback)  # Affiche la trace complète dans la console
         await ctx.send("⚠️ Une erreur inattendue est survenue.")
 
+# Comptage des appels au stockage par commande (repérage des N+1, voir $db_stats)
+@bot.before_invoke
+async def begin_db_scope(ctx):
+    metrics.begin_scope(f"${ctx.command.qualified_name}")
+
+@bot.after_invoke
+async def end_db_scope(ctx):
+    metrics.end_scope()
+
 # Chargement des extensions (Cog), approche asynchrone
 async def load_extensions():
-    await bot.load_extension("db_manager")
+    # Backend de stockage choisi au démarrage : DB_BACKEND=sqlite (défaut) ou memory
+    backend = os.environ.get("DB_BACKEND", DEFAULT_DB_BACKEND)
+    if backend not in DB_BACKENDS:
+        raise RuntimeError(f"❌ Backend de stockage inconnu : `{backend}` (disponibles : {', '.join(DB_BACKENDS)})")
+    await bot.load_extension(DB_BACKENDS[backend])
     await bot.load_extension("economy_manager")
     await bot.load_extension("bot_commands")
     await bot.load_extension("Boutique")
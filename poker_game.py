@@ -8,7 +8,8 @@ import asyncio
 from discord.ui import Button, View, Modal, TextInput
 
 
-from db_manager import DBManager
+from storage import StorageBackend
+from fixed_point import SCALE, to_milli
 
 MIN_PLAYERS = 1
 
@@ -66,7 +67,7 @@ class PokerGame:
     def __init__(self, bot):
         self.bot = bot
         self.status: GameStatus = GameStatus.OFF
-        self._db: DBManager = self.bot.get_cog("DBManager")
+        self._db: StorageBackend = self.bot.get_cog("DBManager")
         self.players = []  # List of players
         self.deck = Deck()
         self.community_cards = []  # Community cards
@@ -241,7 +242,7 @@ class PokerGame:
     def reset_bets(self):
         self.players_bets = {player: 0 for player in self.players}
 
-    def collect_bets(self):
+    async def collect_bets(self):
         # Collecting players' bets into the pot
         for player, bet in self.players_bets.items():
             if player not in self.folded_players:
@@ -249,13 +250,14 @@ class PokerGame:
                 #FIXME balance or chips
                 self.player_chips[player] -= bet
                 if not isinstance(player, FakeMember):
-                    self._db.user_add_balance(
-                        player.id, -bet)  # Update the player's balance
+                    await self._db.user_add_balance(
+                        player.id, -to_milli(bet), reason="poker_mise",
+                        ref=f"poker:{self.game_id}")  # Update the player's balance
 
                 self.players_bets[player] = 0
 
-    def next_card(self):
-        self.collect_bets()
+    async def next_card(self):
+        await self.collect_bets()
         self.min_bet_tour = 0  # min_bet_tour reset
         community_cards_count = len(self.community_cards)
 
@@ -294,21 +296,22 @@ class PokerGame:
     def get_current_max_bet(self):
         return max(self.players_bets.values(), default=0)
 
-    def start_game(self):
+    async def start_game(self):
         self.bot_committed_players = set()
         self.status = GameStatus.RUNNING
         self.min_bet_tour = 3
 
-        self._init_players()
+        await self._init_players()
         self.deal_cards()
         self.reset_current_player()
 
-    def _init_players(self):
+    async def _init_players(self):
         for player in self.players:
             if not isinstance(player, FakeMember):
-                self._db.user_ensure_exist(player)
-                self.player_chips[player] = self._db.user_get_balance(
-                    player.id)  # Get the player's balance from DB
+                await self._db.user_ensure_exist(player)
+                # Chips in whole jetons; the DB balance is in milli-jetons
+                self.player_chips[player] = await self._db.user_get_balance(
+                    player.id) // SCALE  # Get the player's balance from DB
             else:
                 self.player_chips[player] = 100
 
@@ -373,16 +376,19 @@ class PokerGame:
                 self.winners.append(player)
 
 
-    def end_game(self):
+    async def end_game(self):
         self.status = GameStatus.ENDED
         self.determine_winner()
         if len(self.winners) > 0:
-            gain = self.pot / len(self.winners)
-            for player in self.winners:
+            # Integer split: the remainder goes one jeton at a time to the first winners
+            share, remainder = divmod(self.pot, len(self.winners))
+            for index, player in enumerate(self.winners):
+                gain = share + (1 if index < remainder else 0)
                 #FIXME update balance or chips ?
                 self.player_chips[player] += gain
                 if not isinstance(player, FakeMember):
-                    self._db.user_add_balance(player.id, gain)
+                    await self._db.user_add_balance(player.id, to_milli(gain), reason="poker_gain",
+                                                    ref=f"poker:{self.game_id}")
 
     def reset_game(self):
         #self.players.clear()
@@ -520,13 +526,13 @@ class PokerGame:
         await ctx.send(f"Le tour est terminé ")
 
         # No next player, reveal next card
-        ret = self.next_card()
+        ret = await self.next_card()
         if ret:
             await ctx.send(ret)
             self.reset_current_player()
             await self.display_player_window(self.current_player)
         else:
-            self.end_game()
+            await self.end_game()
             winners_text = ', '.join([winner.name for winner in self.winners])
             await ctx.send(
                 f"Le jeu est terminé! Le gagnant est: **{winners_text}** avec une **{self.winning_hand_type}**. Le pot de **{self.pot} jetons** a été distribué."
@@ -623,7 +629,7 @@ class MockGame:
     def can_start(self):
         return len(self.players) >= 2
 
-    def start_game(self):
+    async def start_game(self):
         pass
 
     def start_betting_round(self):
@@ -713,7 +719,7 @@ class StartView(discord.ui.View):
             await interaction.followup.send("La partie ne peut pas être démarrée !", ephemeral=False)
             return
         self.clear_items()
-        self.game.start_game()
+        await self.game.start_game()
         self.game.start_betting_round()
         await self.game.display_player_window(self.game.players[0])
         
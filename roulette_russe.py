@@ -2,14 +2,17 @@
 import discord
 import random
 from discord.ext import commands
-from db_manager import DBManager
+from storage import StorageBackend
+from fixed_point import format_milli, to_milli
+
+ROULETTE_ITEM_NAME = "Roulette russe"  # Article de la boutique donnant accès au jeu
 
 class RouletteRusse(commands.Cog):
     """Jeu de roulette russe avec système de mise."""
     
     def __init__(self, bot):
         self.bot = bot
-        self._db: DBManager | None = None
+        self._db: StorageBackend | None = None
         self.games = {}  # Stocke les parties en cours par utilisateur
     
     async def cog_load(self):
@@ -40,17 +43,35 @@ class RouletteRusse(commands.Cog):
         if mise <= 0:
             await ctx.send("⚠️ La mise doit être supérieure à 0 !")
             return
-        
-        # Vérifier l'existence du joueur et son solde
-        self._db.user_ensure_exist(ctx.author)
-        balance = self._db.user_get_balance(ctx.author.id)
-        
-        if balance < mise:
-            await ctx.send(f"💰 Solde insuffisant ! Vous avez {balance} jetons, mais vous voulez miser {mise} jetons.")
+
+        # Partie réservée avant le premier await : une seconde invocation simultanée est refusée
+        self.games[ctx.author.id] = None
+        try:
+            await self._start_game(ctx, mise)
+        finally:
+            # Partie non démarrée (accès refusé, solde insuffisant, erreur) : libérer la réservation
+            if self.games.get(ctx.author.id) is None:
+                self.games.pop(ctx.author.id, None)
+
+    async def _start_game(self, ctx, mise):
+        """Contrôle l'accès, prélève la mise et crée la partie réservée par roulette_russe."""
+        # Accès réservé aux possesseurs de l'article (sans effet s'il a été retiré de la boutique)
+        item_id = await self._db.get_item_id(ROULETTE_ITEM_NAME)
+        if item_id is not None and not await self._db.user_owns_item(ctx.author.id, item_id):
+            await ctx.send(f"🔒 Achetez l'article **{ROULETTE_ITEM_NAME}** dans la boutique (`$shop`) pour jouer !")
             return
         
-        # Débiter la mise de base une seule fois
-        self._db.user_add_balance(ctx.author.id, -mise)
+        # Vérifier l'existence du joueur puis débiter la mise de base une seule fois,
+        # contrôle du solde et débit dans la même écriture
+        await self._db.user_ensure_exist(ctx.author)
+        result = await self._db.user_spend_balance(ctx.author.id, to_milli(mise), reason="roulette_mise")
+        if result is None:
+            await ctx.send("❌ Erreur lors du prélèvement de la mise.")
+            return
+        spent, balance = result
+        if not spent:
+            await ctx.send(f"💰 Solde insuffisant ! Vous avez {format_milli(balance)} jetons, mais vous voulez miser {mise} jetons.")
+            return
         
         # Créer une nouvelle partie
         self.games[ctx.author.id] = {
@@ -81,7 +102,7 @@ class RouletteRusse(commands.Cog):
     async def tirer(self, ctx):
         """Tirer une balle dans la roulette russe."""
         
-        if ctx.author.id not in self.games:
+        if self.games.get(ctx.author.id) is None:
             await ctx.send("🎯 Vous n'avez pas de partie en cours ! Utilisez `$roulette <mise>` pour commencer.")
             return
         
@@ -119,7 +140,7 @@ class RouletteRusse(commands.Cog):
                 # Le joueur a survécu à toutes les chambres !
                 # Gain = mise de base × 12 (6 chambres × 2)
                 gain = mise_base * 12
-                self._db.user_add_balance(ctx.author.id, gain)
+                await self._db.user_add_balance(ctx.author.id, to_milli(gain), reason="roulette_gain")
                 
                 embed = discord.Embed(
                     title="🎉 VICTOIRE !",
@@ -157,7 +178,7 @@ class RouletteRusse(commands.Cog):
     async def fuir(self, ctx):
         """Abandonner la partie de roulette russe."""
         
-        if ctx.author.id not in self.games:
+        if self.games.get(ctx.author.id) is None:
             await ctx.send("🏃 Vous n'avez pas de partie en cours à abandonner !")
             return
         
@@ -191,18 +212,19 @@ class RouletteRusse(commands.Cog):
         
         # Pour l'instant, on affiche juste le solde
         # On pourrait ajouter des stats spécifiques plus tard
-        self._db.user_ensure_exist(membre)
-        balance = self._db.user_get_balance(membre.id)
+        await self._db.user_ensure_exist(membre)
+        balance = await self._db.user_get_balance(membre.id)
+        balance_text = f"{format_milli(balance)} jetons" if balance is not None else "indisponible"
         
         embed = discord.Embed(
             title="📊 Statistiques Roulette Russe",
             description=f"**{membre.display_name}**\n\n"
-                       f"💰 Solde actuel: **{balance} jetons**",
+                       f"💰 Solde actuel: **{balance_text}**",
             color=discord.Color.blue()
         )
         
-        if ctx.author.id in self.games:
-            game = self.games[ctx.author.id]
+        game = self.games.get(ctx.author.id)
+        if game:
             embed.add_field(
                 name="🎲 Partie en cours",
                 value=f"Mise: {game['mise']} jetons\n"
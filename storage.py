@@ -0,0 +1,227 @@
+"""Interface commune des backends de stockage.
+
+Les cogs récupèrent le backend via `bot.get_cog("DBManager")` et n'utilisent que
+les méthodes ci-dessous. Deux implémentations :
+
+- `db_manager.DBManager` : SQLite (fichier shops.db) ;
+- `db_memory.MemoryDBManager` : tout en mémoire, mêmes sémantiques, pour les
+  benchmarks et tests de charge.
+
+Le backend est choisi au démarrage par la variable d'environnement DB_BACKEND
+(`sqlite` par défaut, ou `memory`). Les montants d'argent et de niveau sont en
+millièmes (voir fixed_point.py), les prix des articles en jetons entiers.
+"""
+
+import unicodedata
+from fixed_point import to_milli
+
+DB_BACKENDS = {
+    "sqlite": "db_manager",
+    "memory": "db_memory",
+}
+DEFAULT_DB_BACKEND = "sqlite"
+
+# Valeurs communes à tous les backends
+DEFAULT_ARGENT = to_milli(500)  # Solde de départ d'un nouvel utilisateur
+REWARDS_FLUSH_INTERVAL = 5  # secondes entre deux écritures des gains en attente
+LEDGER_RETENTION_DAYS = 30  # au-delà, les entrées du journal sont repliées dans les instantanés
+LEDGER_COMPACTION_INTERVAL = 24  # heures entre deux compactions du journal
+PURCHASES_PAGE_SIZE = 10  # achats par page de l'historique
+
+# Tris disponibles pour StorageBackend.get_items_page
+ITEM_SORTS = ("price", "name")
+
+# Résultats de StorageBackend.purchase
+PURCHASE_OK = "ok"
+PURCHASE_NO_ITEM = "article_introuvable"
+PURCHASE_NO_FUNDS = "solde_insuffisant"
+PURCHASE_SOLD_OUT = "rupture_de_stock"
+PURCHASE_LIMIT_REACHED = "limite_atteinte"
+
+
+
+def search_words(text):
+    """Découpe un texte en mots comme le tokenizer unicode61 de FTS5 (remove_diacritics 2).
+
+    Minuscules, accents retirés, tout caractère non alphanumérique sépare deux mots :
+    « l'Épée » donne ["l", "epee"]. Utilisé par les deux backends pour search_items.
+    """
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    folded = "".join(char for char in decomposed if not unicodedata.combining(char)).lower()
+    return "".join(char if char.isalnum() else " " for char in folded).split()
+
+
+class StorageBackend:
+    """Méthodes que tout backend de stockage doit fournir."""
+
+    # Schéma
+    async def create_db(self):
+        """Prépare le stockage (schéma, articles par défaut)."""
+        raise NotImplementedError
+
+    async def drop_db(self):
+        """Supprime les utilisateurs."""
+        raise NotImplementedError
+
+    # Utilisateurs
+    async def user_get_balance(self, user_id):
+        """Argent de l'utilisateur, gains en attente compris ; None s'il n'existe pas."""
+        raise NotImplementedError
+
+    async def user_add_balance(self, user_id, amount, reason="ajustement", ref=None):
+        """Ajoute `amount` à l'argent (utilisateur créé au besoin) ; retourne le nouveau solde."""
+        raise NotImplementedError
+
+    async def user_spend_balance(self, user_id, amount, reason="depense", ref=None):
+        """Débite `amount` seulement si le solde (gains en attente compris) suffit, de façon atomique.
+
+        Retourne (True, nouveau solde) ou (False, solde actuel) ; None en cas d'erreur.
+        """
+        raise NotImplementedError
+
+    async def user_transfer_balance(self, from_id, to_id, amount,
+                                    sent_reason="don_envoye", received_reason="don_recu"):
+        """Transfère `amount` de `from_id` à `to_id` si le solde suffit, débit et crédit ensemble.
+
+        Retourne (True, solde émetteur, solde destinataire) ou (False, solde émetteur, None) ;
+        None en cas d'erreur.
+        """
+        raise NotImplementedError
+
+    async def user_reset_balance(self, user_id, reason="reset", ref=None):
+        """Remet l'argent à zéro ; retourne le nouveau solde."""
+        raise NotImplementedError
+
+    async def user_get_niveau(self, user_id):
+        """Niveau de l'utilisateur, gains en attente compris ; None s'il n'existe pas."""
+        raise NotImplementedError
+
+    async def user_add_niveau(self, user_id, amount, reason="ajustement", ref=None):
+        """Ajoute `amount` au niveau (utilisateur créé au besoin) ; retourne le nouveau niveau."""
+        raise NotImplementedError
+
+    async def user_reset_niveau(self, user_id, reason="reset", ref=None):
+        """Remet le niveau à zéro ; retourne le nouveau niveau."""
+        raise NotImplementedError
+
+    async def user_ensure_exist(self, member):
+        """Crée l'utilisateur à partir d'un membre Discord s'il n'existe pas."""
+        raise NotImplementedError
+
+    async def user_create(self, user_id):
+        """Crée l'utilisateur avec les valeurs par défaut s'il n'existe pas."""
+        raise NotImplementedError
+
+    def user_cache_stats(self):
+        """Compteurs du cache utilisateur (size, max_size, hits, misses, evictions, hit_rate)."""
+        raise NotImplementedError
+
+    # Gains différés et mutations groupées
+    def user_queue_reward(self, user_id, money=0, xp=0):
+        """Accumule un gain, écrit au prochain flush_rewards."""
+        raise NotImplementedError
+
+    def add_reward_settler(self, settler):
+        """Enregistre `settler(user_id)`, source de gains accumulés hors base (ex. temps en vocal).
+
+        Il est appelé avant toute lecture des gains en attente d'un utilisateur, et avec
+        None à l'arrêt pour tous les utilisateurs ; il verse ses gains par user_queue_reward.
+        """
+        raise NotImplementedError
+
+    def remove_reward_settler(self, settler):
+        """Retire une source enregistrée par add_reward_settler."""
+        raise NotImplementedError
+
+    async def flush_rewards(self):
+        """Écrit tous les gains en attente."""
+        raise NotImplementedError
+
+    async def bulk_add_balance(self, deltas, reason="ajustement", ref=None):
+        """Ajoute de l'argent à plusieurs utilisateurs : liste de (user_id, montant)."""
+        raise NotImplementedError
+
+    async def bulk_add_niveau(self, deltas, reason="ajustement", ref=None):
+        """Ajoute des niveaux à plusieurs utilisateurs : liste de (user_id, montant)."""
+        raise NotImplementedError
+
+    async def bulk_ensure_users(self, user_ids):
+        """Crée les utilisateurs absents parmi `user_ids`."""
+        raise NotImplementedError
+
+    # Journal des transactions
+    async def get_user_ledger(self, user_id, limit=20):
+        """Dernières entrées (argent, niveau, reason, ref, created_at), plus récentes d'abord."""
+        raise NotImplementedError
+
+    async def compact_ledger(self, retention_days=LEDGER_RETENTION_DAYS):
+        """Replie les entrées anciennes dans les instantanés ; retourne le nombre replié."""
+        raise NotImplementedError
+
+    # Boutique
+    async def get_all_items(self):
+        """Liste des articles (id, name, price, description)."""
+        raise NotImplementedError
+
+    async def get_item(self, item_id):
+        """Article (name, price, description) ou None."""
+        raise NotImplementedError
+
+    async def get_items_page(self, sort="price", after=None, limit=20):
+        """Page d'articles (id, name, price, description) triés par `sort` puis id.
+
+        Pagination par clé : `after` est le curseur (valeur du tri, id) du dernier
+        article de la page précédente, None pour la première page.
+        """
+        raise NotImplementedError
+
+    async def search_items(self, text, limit=10):
+        """Articles (id, name, price, description) correspondant à `text`, les plus pertinents d'abord.
+
+        Les mots sont découpés par search_words ; chacun est cherché comme préfixe, sans tenir
+        compte de la casse ni des accents, et tous doivent apparaître dans le nom ou la description.
+        """
+        raise NotImplementedError
+
+    async def add_item(self, name, price, description=""):
+        """Ajoute un article ; retourne True en cas de succès."""
+        raise NotImplementedError
+
+    async def remove_item(self, item_id):
+        """Supprime un article ; retourne True s'il existait."""
+        raise NotImplementedError
+
+    async def set_item_stock(self, item_id, stock=None, per_user_limit=None):
+        """Fixe le stock et la limite par utilisateur d'un article (None = illimité) ; True s'il existe."""
+        raise NotImplementedError
+
+    async def get_item_stock(self, item_id):
+        """(stock, per_user_limit) d'un article, None pour illimité ; None si l'article n'existe pas."""
+        raise NotImplementedError
+
+    async def purchase(self, user_id, item_id):
+        """Achat atomique : vérifie prix, stock, limite et solde, débite, décrémente le stock
+        et enregistre l'achat en une transaction.
+
+        Retourne (statut, solde, article) : statut PURCHASE_OK (solde après débit),
+        PURCHASE_NO_FUNDS, PURCHASE_SOLD_OUT ou PURCHASE_LIMIT_REACHED (solde actuel)
+        ou PURCHASE_NO_ITEM (solde et article None) ; None en cas d'erreur.
+        L'article est (name, price, description).
+        """
+        raise NotImplementedError
+
+    async def get_inventory(self, user_id):
+        """Inventaire (item_id, name, quantity) d'un utilisateur, trié par nom."""
+        raise NotImplementedError
+
+    async def user_owns_item(self, user_id, item_id):
+        """True si l'utilisateur possède au moins un exemplaire de l'article."""
+        raise NotImplementedError
+
+    async def get_item_id(self, name):
+        """Id du premier article portant ce nom, ou None."""
+        raise NotImplementedError
+
+    async def get_user_purchases(self, user_id, before=None, limit=PURCHASES_PAGE_SIZE):
+        """Page d'achats (id, nom, timestamp), plus récents d'abord, avant le curseur (timestamp, id)."""
+        raise NotImplementedError
@@ -0,0 +1,26 @@
+import asyncio
+import pytest
+from db_manager import DBManager
+from db_memory import MemoryDBManager
+
+
+@pytest.fixture(params=[DBManager, MemoryDBManager], ids=["sqlite", "memory"])
+def backend_cls(request, tmp_path, monkeypatch):
+    """Classe du backend testé ; la base SQLite est créée dans un dossier temporaire."""
+    monkeypatch.chdir(tmp_path)
+    return request.param
+
+
+@pytest.fixture
+def run_on_backend(backend_cls):
+    """Exécute la coroutine `scenario(db)` sur un backend chargé puis déchargé."""
+    def run(scenario):
+        async def main():
+            db = backend_cls(None)
+            await db.cog_load()
+            try:
+                await scenario(db)
+            finally:
+                await db.cog_unload()
+        asyncio.run(main())
+    return run
@@ -0,0 +1,51 @@
+import asyncio
+from types import SimpleNamespace
+from fixed_point import to_milli
+from roulette_russe import RouletteRusse
+
+
+def test_concurrent_transfers_never_overdraw(run_on_backend):
+    async def scenario(db):
+        await db.user_create(1)
+        results = await asyncio.gather(*(db.user_transfer_balance(1, 2, to_milli(400)) for _ in range(3)))
+
+        assert sorted(success for success, _, _ in results) == [False, False, True]
+        assert await db.user_get_balance(1) == to_milli(100)
+        assert await db.user_get_balance(2) == to_milli(900)
+
+    run_on_backend(scenario)
+
+
+def test_concurrent_spends_never_overdraw(run_on_backend):
+    async def scenario(db):
+        await db.user_create(1)
+        results = await asyncio.gather(*(db.user_spend_balance(1, to_milli(200)) for _ in range(5)))
+
+        assert [spent for spent, _ in results].count(True) == 2
+        assert await db.user_get_balance(1) == to_milli(100)
+        ledger = await db.get_user_ledger(1)
+        assert sum(argent for argent, _, reason, *_ in ledger if reason == "depense") == -to_milli(400)
+
+    run_on_backend(scenario)
+
+
+def test_concurrent_roulette_takes_a_single_stake(run_on_backend):
+    async def scenario(db):
+        roulette = RouletteRusse(SimpleNamespace(get_cog=lambda name: db))
+        await roulette.cog_load()
+        author = SimpleNamespace(id=1, name="joueur", display_name="joueur")
+        sent = []
+
+        async def send(*args, **kwargs):
+            sent.append(args or kwargs)
+
+        ctx = SimpleNamespace(author=author, send=send)
+        await db.user_create(1)
+        await db.purchase(1, await db.get_item_id("Roulette russe"))  # 200 jetons, accès au jeu
+
+        await asyncio.gather(*(roulette.roulette_russe.callback(roulette, ctx, 50) for _ in range(3)))
+
+        assert await db.user_get_balance(1) == to_milli(250)
+        assert roulette.games[1]["mise"] == 50
+
+    run_on_backend(scenario)
@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+from bot_commands import BotCommands
+from fixed_point import to_milli
+
+
+def member(user_id):
+    return SimpleNamespace(id=user_id, name=f"membre{user_id}", mention=f"<@{user_id}>",
+                           discriminator="0", joined_at=None, roles=[])
+
+
+def test_crediter_member_without_account(run_on_backend):
+    async def scenario(db):
+        cog = BotCommands(SimpleNamespace(get_cog=lambda name: db))
+        await cog.cog_load()
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        ctx = SimpleNamespace(author=member(1), send=send)
+        await cog.crediter.callback(cog, ctx, member(2), 100)
+
+        assert await db.user_get_balance(2) == to_milli(600)
+        assert "Ancien solde : 500 jetons" in sent[0]
+
+    run_on_backend(scenario)
@@ -0,0 +1,54 @@
+"""Test de charge : vente flash d'un article en stock limité, clics simultanés."""
+import asyncio
+from collections import Counter
+from fixed_point import to_milli
+from storage import PURCHASE_OK
+
+STOCK = 50
+PRICE = 100
+PER_USER_LIMIT = 2
+BUYERS = range(1000, 1200)
+CLICKS_PER_BUYER = 3
+
+
+def test_flash_sale_neither_oversells_nor_overdraws(run_on_backend):
+    async def scenario(db):
+        await db.add_item("Flash", PRICE, "vente flash")
+        item_id = await db.get_item_id("Flash")
+        assert await db.set_item_stock(item_id, STOCK, PER_USER_LIMIT)
+
+        # Un acheteur sur quatre ne peut payer qu'un exemplaire
+        start = {}
+        for user_id in BUYERS:
+            if user_id % 4 == 0:
+                await db.user_reset_balance(user_id)
+                await db.user_add_balance(user_id, to_milli(150))
+            else:
+                await db.user_create(user_id)
+            start[user_id] = await db.user_get_balance(user_id)
+
+        clicks = [user_id for _ in range(CLICKS_PER_BUYER) for user_id in BUYERS]
+        results = await asyncio.gather(*(db.purchase(user_id, item_id) for user_id in clicks))
+
+        assert None not in results
+        assert Counter(status for status, _, _ in results)[PURCHASE_OK] == STOCK
+        assert await db.get_item_stock(item_id) == (0, PER_USER_LIMIT)
+
+        sold = 0
+        for user_id in BUYERS:
+            owned = {item: quantity for item, _, quantity in await db.get_inventory(user_id)}.get(item_id, 0)
+            purchases = await db.get_user_purchases(user_id, limit=CLICKS_PER_BUYER + 1)
+            spent = -sum(argent for argent, _, reason, ref, _ in await db.get_user_ledger(user_id, limit=50)
+                         if reason == "achat" and ref == f"item:{item_id}")
+            balance = await db.user_get_balance(user_id)
+
+            assert owned <= PER_USER_LIMIT
+            assert len(purchases) == owned
+            assert spent == owned * to_milli(PRICE)
+            assert balance == start[user_id] - spent
+            assert balance >= 0
+            sold += owned
+
+        assert sold == STOCK
+
+    run_on_backend(scenario)
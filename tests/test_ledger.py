@@ -0,0 +1,32 @@
+from fixed_point import to_milli
+from storage import DEFAULT_ARGENT
+
+
+async def replay(db, user_id):
+    """Somme (argent, niveau) des entrées du journal d'un utilisateur."""
+    ledger = await db.get_user_ledger(user_id, limit=100)
+    return sum(entry[0] for entry in ledger), sum(entry[1] for entry in ledger)
+
+
+def test_replay_matches_balance_of_fresh_users(run_on_backend):
+    async def scenario(db):
+        await db.user_create(1)
+        await db.user_add_balance(1, to_milli(1000))
+        await db.user_add_balance(2, to_milli(30))           # compte créé par le crédit
+        await db.user_transfer_balance(1, 3, to_milli(200))  # destinataire créé par le don
+        await db.user_spend_balance(4, to_milli(100))        # compte créé par la dépense
+        await db.user_add_niveau(5, to_milli(2))
+        await db.user_reset_balance(6)
+        await db.user_reset_niveau(7)
+        db.user_queue_reward(8, money=to_milli(5), xp=to_milli(1))
+        await db.flush_rewards()
+        await db.purchase(9, await db.get_item_id("Roulette russe"))
+
+        for user_id in range(1, 10):
+            balance = (await db.user_get_balance(user_id), await db.user_get_niveau(user_id))
+            assert await replay(db, user_id) == balance, user_id
+
+        opening = [entry for entry in await db.get_user_ledger(1) if entry[2] == "ouverture"]
+        assert [entry[:2] for entry in opening] == [(DEFAULT_ARGENT, 0)]
+
+    run_on_backend(scenario)
@@ -0,0 +1,49 @@
+import asyncio
+from fixed_point import to_milli
+from storage import PURCHASE_NO_FUNDS, PURCHASE_OK
+
+
+def test_purchase_in_same_batch_as_flush_does_not_overdraw(run_on_backend):
+    async def scenario(db):
+        await db.user_reset_balance(7)
+        db.user_queue_reward(7, money=to_milli(150))
+        item_id = await db.get_item_id("Roulette russe")  # 200 jetons
+
+        _, result = await asyncio.gather(db.flush_rewards(), db.purchase(7, item_id))
+
+        assert result[0] == PURCHASE_NO_FUNDS
+        assert result[1] == to_milli(150)
+        assert await db.user_get_balance(7) == to_milli(150)
+
+    run_on_backend(scenario)
+
+
+def test_purchase_in_same_batch_as_flush_counts_flushed_money_once(run_on_backend):
+    async def scenario(db):
+        await db.user_reset_balance(7)
+        db.user_queue_reward(7, money=to_milli(250))
+        item_id = await db.get_item_id("Roulette russe")
+
+        _, result = await asyncio.gather(db.flush_rewards(), db.purchase(7, item_id))
+
+        assert result[0] == PURCHASE_OK
+        assert result[1] == to_milli(50)
+        assert await db.user_get_balance(7) == to_milli(50)
+
+    run_on_backend(scenario)
+
+
+def test_add_balance_and_niveau_after_flush_return_real_totals(run_on_backend):
+    async def scenario(db):
+        await db.user_create(7)
+        db.user_queue_reward(7, money=to_milli(10), xp=to_milli(2))
+
+        _, balance, niveau = await asyncio.gather(
+            db.flush_rewards(), db.user_add_balance(7, 0), db.user_add_niveau(7, 0))
+
+        assert balance == to_milli(510)
+        assert niveau == to_milli(2)
+        assert await db.user_get_balance(7) == to_milli(510)
+        assert await db.user_get_niveau(7) == to_milli(2)
+
+    run_on_backend(scenario)
@@ -0,0 +1,22 @@
+import pytest
+
+
+@pytest.mark.parametrize("text", ["l'épée", "L'EPEE", "épée aube", "ep", "aube-l"])
+def test_search_splits_words_like_the_tokenizer(run_on_backend, text):
+    async def scenario(db):
+        await db.add_item("Épée de l'aube", 100, "Une lame forgée à l'aurore")
+        await db.add_item("Bouclier", 50, "Protège des épées")
+
+        names = [name for _, name, _, _ in await db.search_items(text)]
+
+        assert names[0] == "Épée de l'aube"
+
+    run_on_backend(scenario)
+
+
+def test_search_ignores_fts_syntax(run_on_backend):
+    async def scenario(db):
+        assert await db.search_items('" OR * NEAR(') == []
+        assert await db.search_items("!!!") == []
+
+    run_on_backend(scenario)
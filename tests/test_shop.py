@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+from Boutique import SHOP_PAGE_SIZE, Boutique
+
+
+def test_list_items_served_from_page_cache(run_on_backend):
+    async def scenario(db):
+        for i in range(SHOP_PAGE_SIZE + 5):
+            await db.add_item(f"Article {i}", 1000 + i)
+        shop = Boutique(SimpleNamespace(get_cog=lambda name: db))
+        await shop.cog_load()
+
+        reads = []
+        get_items_page = db.get_items_page
+
+        async def counting_get_items_page(*args):
+            reads.append(args)
+            return await get_items_page(*args)
+
+        db.get_items_page = counting_get_items_page
+        sent = []
+
+        async def send(embed):
+            sent.append(embed)
+
+        ctx = SimpleNamespace(send=send)
+        await shop.list_items.callback(shop, ctx)
+        await shop.list_items.callback(shop, ctx)
+
+        assert len(reads) == 2  # deux pages, lues une seule fois
+        assert sum(len(embed.fields) for embed in sent) == 2 * (SHOP_PAGE_SIZE + 5 + 2)
+
+    run_on_backend(scenario)
@@ -0,0 +1,36 @@
+import asyncio
+import sqlite3
+from db_manager import DBManager
+from fixed_point import to_milli
+
+
+def test_failed_flush_does_not_credit_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def main():
+        db = DBManager(None)
+        await db.cog_load()
+        try:
+            await db.user_create(7)
+            assert await db.user_get_balance(7) == to_milli(500)  # ligne en cache
+
+            async def failing_upsert(conn, deltas):
+                raise sqlite3.OperationalError("disk I/O error")
+
+            db.user_queue_reward(7, money=to_milli(2))
+            with monkeypatch.context() as patch:
+                patch.setattr(db, "_upsert_deltas", failing_upsert)
+                await db.flush_rewards()
+
+            # Gain remis en attente, cache non crédité : compté une seule fois
+            assert db._user_cache.get(7) != (True, (to_milli(502), 0))
+            assert await db.user_get_balance(7) == to_milli(502)
+
+            await db.flush_rewards()
+            assert await db.user_get_balance(7) == to_milli(502)
+            async with db._conn.execute("SELECT argent FROM users WHERE user_id = 7") as cursor:
+                assert (await cursor.fetchone())[0] == to_milli(502)
+        finally:
+            await db.cog_unload()
+
+    asyncio.run(main())